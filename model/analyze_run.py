@@ -1,6 +1,6 @@
 #/Users/tom/python2.7/bin/python
 
-from collections import defaultdict, Iterable
+from collections import defaultdict, Iterable, Mapping, OrderedDict
 import itertools as it
 import json
 import os
@@ -14,7 +14,9 @@ import pandas as pd
 from pathlib import Path
 from scipy import interpolate
 
-from helpers import load_params, sample_path
+from fast_kde import BinnedKDE
+from helpers import load_params, sample_panel, sample_path
+from result_store import ResultStore
 from value_function import u_
 
 def bin_results(res_dir):
@@ -63,6 +65,42 @@ def load_single(pth):
     return res
 
 
+def _parse_name(fname, kind):
+    """
+    (pi, lambda_) from the name of a file of type kind, or None.
+    """
+    match = re.match(r"[tst_]*" + kind + r"_(\d*)_(\d*).*", fname)
+    if match is None:
+        return None
+    # Change the first zero to a decimal point that was
+    # removed during writing.
+    return tuple(float(x.replace('0', '.', 1)) for x in match.groups())
+
+
+def _load_rigid_output(pth):
+    with open(pth, 'r') as f:
+        try:
+            return float(f.read())
+        except ValueError:
+            f.seek(0)
+            return float(json.load(f)[0])
+
+
+def _load_pickle(pth):
+    with open(pth, 'rb') as f:
+        return pickle.load(f)
+
+
+def _load_panel(pth):
+    reg = re.compile(r"[tst_]*results_(\d*)_(\d*).*")
+    storename = '_'.join(reg.match(os.path.basename(pth)).groups())
+    return pd.read_hdf(pth, 'pi_' + storename)
+
+
+_LOADERS = {'rigid_output': _load_rigid_output, 'vf': _load_pickle,
+            'ws': _load_pickle, 'gp': _load_pickle, 'results': _load_panel}
+
+
 def _read_rigid_output(fnames, prepend=''):
     """
     Construct a dict of {pi: output} given a list of files.
@@ -71,42 +109,20 @@ def _read_rigid_output(fnames, prepend=''):
     all_files = os.listdir('results/')
     res = read_output(all_files)
     """
-    # Trouble with where they run it from.
-    reg = re.compile(r"[tst_]*rigid_output_(\d*)_(\d*).*")
     pi_out_dict = {}
     for fname in fnames:
-        # Change the first zero to a decimal point that was
-        # removed during writing.
-        try:
-            match = reg.match(fname)
-            pi = float(match.groups()[0].replace('0', '.', 1))
-            lambda_ = float(match.groups()[1].replace('0', '.', 1))
-        except AttributeError:
-            continue
-        with open(prepend + fname, 'r') as f:
-            try:
-                pi_out_dict[(pi, lambda_)] = float(f.read())
-            except ValueError:
-                f.seek(0)
-                val = json.load(f)
-                pi_out_dict[(pi, lambda_)] = float(val[0])
+        key = _parse_name(fname, 'rigid_output')
+        if key is not None:
+            pi_out_dict[key] = _load_rigid_output(prepend + fname)
     return pi_out_dict
 
 
 def _read_pickleable(fnames, kind, prepend=''):
-    reg = re.compile(r"[tst_]*" + kind + "_(\d*)_(\d*).*")
     pi_dict = {}
     for fname in fnames:
-        # Change the first zero to a decimal point that was
-        # removed during writing.
-        try:
-            match = reg.match(fname)
-            pi = float(match.groups()[0].replace('0', '.', 1))
-            lambda_ = float(match.groups()[1].replace('0', '.', 1))
-        except AttributeError:
-            continue
-        with open(prepend + fname, 'rb') as f:
-            pi_dict[(pi, lambda_)] = pickle.load(f)
+        key = _parse_name(fname, kind)
+        if key is not None:
+            pi_dict[key] = _load_pickle(prepend + fname)
     return pi_dict
 
 
@@ -136,7 +152,64 @@ def group_results(fnames, prepend=''):
         store.close()
 
 
-def read_output(fnames, kind):
+class LazyResults(Mapping):
+
+    def __init__(self, keys, load, maxsize=32):
+        """
+        Read-only {(pi, lambda_): result} that calls load(key) the first
+        time key is accessed, keeping the maxsize most recently used
+        results.
+
+        Parameters
+        ----------
+
+        keys : iterable of (pi, lambda_).
+        load : callable.  key -> result.
+        maxsize : int.
+        """
+        self._keys = list(keys)
+        self._key_set = set(self._keys)
+        self.load = load
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+
+    def __getitem__(self, key):
+        if key not in self._key_set:
+            raise KeyError(key)
+        try:
+            val = self._cache.pop(key)
+        except KeyError:
+            val = self.load(key)
+        self._cache[key] = val
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return val
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+def _lazy_files(files, kind, prepend='', maxsize=32):
+    """LazyResults over {(pi, lambda_): file name}."""
+    load = _LOADERS[kind]
+    return LazyResults(files, lambda key: load(prepend + files[key]),
+                       maxsize=maxsize)
+
+
+def _lazy_store(store, kind, maxsize=32):
+    """LazyResults over the final results in a ResultStore."""
+    if kind == 'results':
+        kind = 'rest'
+    keys = store.select('scalars', columns=[])
+    return LazyResults(zip(keys.pi, keys.lambda_),
+                       lambda key: store.load(kind, *key)[key],
+                       maxsize=maxsize)
+
+
+def read_output(fnames, kind, store='store.h5', lazy=False, maxsize=32):
     """
     Public API for reading files of type kind.
     kind is one of:
@@ -145,25 +218,103 @@ def read_output(fnames, kind):
         - gp :: Interp for wage dist
         - ws :: Interp for wage schedule
         - results :: HDFStore of panels
+
+    If store (the file name of a ResultStore) is among fnames, everything
+    but results is read from it in one pass instead of from the
+    separate files.
+
+    With lazy, returns a LazyResults that reads each result when it's
+    accessed, keeping maxsize of them.  For results it maps each key to
+    its own panel (or to its label_vals DataFrame from the store).
     """
     if not os.path.exists(fnames[1]):
         prepend = 'results/'
     else:
         prepend = ''
 
-    if kind == 'rigid_output':
+    if kind not in _LOADERS:
+        raise ValueError("Kind must be one of 'rigid_output'",
+                         "'vf', 'ws', 'gp', or 'results'.",
+                         " Got {} instead.".format(kind))
+    if lazy:
+        if store in fnames:
+            return _lazy_store(ResultStore(prepend + store), kind, maxsize)
+        files = {}
+        for fname in fnames:
+            key = _parse_name(fname, kind)
+            if key is not None:
+                files[key] = fname
+        return _lazy_files(files, kind, prepend, maxsize)
+
+    if store in fnames and kind in ('rigid_output', 'vf', 'gp', 'ws'):
+        return ResultStore(prepend + store).load(kind)
+    elif kind == 'rigid_output':
         return _read_rigid_output(fnames, prepend)
     elif kind in ('vf', 'gp', 'ws'):
         return _read_pickleable(fnames, kind=kind, prepend=prepend)
-    elif kind == 'results':
+    else:
         if not os.path.exists('results/grouped_results.h5'):
             group_results(fnames, prepend)
         return _read_results(fnames, prepend)
-    else:
+
+
+def results_index(pth='results/'):
+    """
+    {kind: {(pi, lambda_): file name}} for the result files in pth.
+
+    The index is kept in pth/.results_index.json and reused until the
+    mtime of pth changes, i.e. until a file is added, removed, or
+    renamed there.  Overwriting a result in place keeps its name, so
+    the index stays good.
+    """
+    index_path = os.path.join(pth, '.results_index.json')
+    try:
+        with open(index_path, 'r') as f:
+            saved = json.load(f)
+        if saved['mtime'] == os.path.getmtime(pth):
+            return {kind: {(pi, lambda_): fname
+                           for pi, lambda_, fname in saved['index'][kind]}
+                    for kind in _LOADERS}
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+
+    # Create the index file before reading the mtime, then write it in
+    # place, which leaves pth's mtime alone.
+    open(index_path, 'a').close()
+    mtime = os.path.getmtime(pth)
+    index = {kind: {} for kind in _LOADERS}
+    for fname in os.listdir(pth):
+        for kind in _LOADERS:
+            key = _parse_name(fname, kind)
+            if key is not None:
+                index[kind][key] = fname
+    saved = {kind: [[pi, lambda_, fname] for (pi, lambda_), fname
+                    in index[kind].items()] for kind in index}
+    with open(index_path, 'w') as f:
+        json.dump({'mtime': mtime, 'index': saved}, f)
+    return index
+
+
+def load_results(kind, params=None, store='store.h5', maxsize=32):
+    """
+    LazyResults of kind (see read_output) for the results in params'
+    results_path.  Keys come from the ResultStore if there is one and
+    from results_index otherwise, so nothing is read until it's used.
+    """
+    if params is None:
+        params = load_params()
+    if kind not in _LOADERS:
         raise ValueError("Kind must be one of 'rigid_output'",
                          "'vf', 'ws', 'gp', or 'results'.",
                          " Got {} instead.".format(kind))
 
+    pth = params['results_path'][0]
+    if os.path.exists(os.path.join(pth, store)):
+        return _lazy_store(ResultStore(os.path.join(pth, store)), kind,
+                           maxsize)
+    return _lazy_files(results_index(pth)[kind], kind,
+                       os.path.join(pth, ''), maxsize)
+
 
 def get_all_files(params=None):
     """Get the files from the results path"""
@@ -261,45 +412,142 @@ def get_outs_df(out_dict):
 def make_panel(wses, params, pairs=None, log=False, nseries=100, nperiods=50,
                seed=42):
     """
-    Panel of wage choices where
-
-        items : (pi, lambda)
-        major : periods
-        minor : series
+    Simulated wage choices for each (pi, lambda) in pairs, all from the
+    same shocks.  See helpers.sample_panel.
 
     seed is an int given to np.random.set_seed().
+
+    Returns
+    -------
+
+    wpan : dict of {(pi, lambda): DataFrame} of wages (logged if log),
+        indexed by period with a column per person.
+    span : dict of {(pi, lambda): DataFrame} of the shocks.  Every key
+        shares the one DataFrame.
+    """
+    keys, vals, shocks = panel_array(wses, params, pairs=pairs, log=log,
+                                     nseries=nseries, nperiods=nperiods,
+                                     seed=seed)
+    sk_df = _period_frame(shocks)
+    wpan = {key: _period_frame(vals[k]) for k, key in enumerate(keys)}
+    span = {key: sk_df for key in keys}
+    return wpan, span
+
+
+def _period_frame(vals):
+    df = pd.DataFrame(vals)
+    df.index.name = 'period'
+    df.columns.name = 'person'
+    return df
+
+
+def panel_array(wses, params, pairs=None, log=False, nseries=100,
+                nperiods=50, seed=42):
+    """
+    make_panel as arrays.
+
+    Returns
+    -------
+
+    keys : list of (pi, lambda) in pairs' order.
+    vals : array of wages (logged if log), key x period x person.
+    shocks : array of shocks, period x person.
     """
     if pairs is None:
-        pairs = wses.iterkeys()
-
-    dfs = {}
-    sks = {}
-    for key in pairs:
-        ws = wses[key]
-        pths, shocks = sample_path(ws, params, w0=.9, lambda_=key[1],
-                                   nseries=nseries, nperiods=nperiods,
-                                   seed=seed)
-        df = pd.DataFrame(pths)
-        shocks = pd.DataFrame(shocks)
+        pairs = wses.keys()
+    keys = list(pairs)
+    vals, shocks = sample_panel([wses[key] for key in keys], params,
+                                [key[1] for key in keys], w0=.9,
+                                nseries=nseries, nperiods=nperiods,
+                                seed=seed)
+    if log:
+        np.log(vals, out=vals)
+    return keys, vals, shocks
+
+
+def panel_stats(wses, params, out_ser=None, pairs=None, log=False,
+                nseries=100, nperiods=50, seed=42, period=30):
+    """
+    The statistics make_hist and get_utils take from make_panel,
+    accumulated period by period without keeping the panel.  Memory is
+    proportional to keys x nseries (plus the shocks).
+
+    Parameters
+    ----------
+
+    wses, params, pairs, log, nseries, nperiods, seed : See make_panel.
+    out_ser : output by (pi, lambda), as for get_utils.  If None the
+        utilities are skipped.
+    period : int.  Period of the wage changes.
+
+    Returns
+    -------
+
+    diffs : DataFrame of wage changes into period, by person, with a
+        column per (pi, lambda).  Pass as pan to make_hist.
+    utils : DataFrame like get_utils(*make_panel(...), out_ser=out_ser),
+        or None.
+    """
+    if not 0 < period < nperiods:
+        raise ValueError("period must be between 1 and nperiods - 1. "
+                         "Got {} instead.".format(period))
+    if pairs is None:
+        pairs = wses.keys()
+    keys = list(pairs)
+    stats = {}
+    if out_ser is not None:
+        aggL = np.array([float(np.squeeze(out_ser.loc[key]))
+                         for key in keys])[:, np.newaxis]
+        stats['utils'] = np.zeros((len(keys), nseries))
+
+    def consume(i, vals, shocks):
         if log:
-            dfs[key] = np.log(df)
-        else:
-            dfs[key] = df
-        sks[key] = shocks
-    df_pan = pd.Panel(dfs)
-    sk_pan = pd.Panel(sks)
-    df_pan.minor_axis.name = 'person'
-    sk_pan.minor_axis.name = 'person'
-    df_pan.items.name = 'key'
-    sk_pan.items.name = 'key'
-    df_pan.major_axis.name = 'period'
-    sk_pan.major_axis.name = 'period'
-    return df_pan, sk_pan
+            vals = np.log(vals)
+        if i == period - 1:
+            stats['last'] = vals.copy()
+        elif i == period:
+            stats['diffs'] = vals - stats.pop('last')
+        if out_ser is not None:
+            stats['utils'] += u_(vals, shock=shocks, aggL=aggL)
+
+    sample_panel([wses[key] for key in keys], params,
+                 [key[1] for key in keys], w0=.9, nseries=nseries,
+                 nperiods=nperiods, seed=seed, consumers=[consume],
+                 keep=False)
+
+    cols = pd.MultiIndex.from_tuples(keys, names=['pi', 'lambda_'])
+    diffs = pd.DataFrame(stats['diffs'].T, columns=cols)
+    diffs.index.name = 'person'
+    utils = None
+    if out_ser is not None:
+        utils = pd.DataFrame(stats['utils'] / nperiods, index=cols)
+        utils = utils.sort_index()
+    return diffs, utils
+
+
+def wage_density(ws, params, lambda_=None, nseries=100000, nperiods=30,
+                 period=28, seed=42, **kwargs):
+    """
+    Density of wages in one period of a simulated cross section.
+
+    kwargs are passed to fast_kde.BinnedKDE, which keeps this cheap for
+    large nseries.
+    """
+    pths, shocks = sample_path(ws, params, lambda_=lambda_, nseries=nseries,
+                               nperiods=nperiods, seed=seed)
+    return BinnedKDE(pths[period], **kwargs)
 
 
 def make_hist(pan, subpairs, ax=None, **kwargs):
-    t = pd.concat([pan.xs(x, axis='items').diff().iloc[30] for x in subpairs],
-                  axis=1)
+    """
+    Histograms of period 30 wage changes for each (pi, lambda) in
+    subpairs.  pan is the wage panel from make_panel or the diffs from
+    panel_stats.
+    """
+    if isinstance(pan, pd.DataFrame):
+        t = pd.concat([pan[x] for x in subpairs], axis=1)
+    else:
+        t = pd.concat([pan[x].diff().iloc[30] for x in subpairs], axis=1)
     t.columns = map(str, subpairs)
     _, idx1, fig = hist(t[t.columns[0]], bins='scott', alpha=.35, width=.0005)
     plt.close()
@@ -350,12 +598,17 @@ def plot_sub(df, pi=None, lambda_=None, **kwargs):
 
 
 def get_utils(wpan, span, out_ser, by_lam=False):
-    keys = wpan.items
+    """
+    Mean utility over periods for each person, by (pi, lambda).  wpan
+    and span are from make_panel; panel_stats gets the same without
+    the panels.
+    """
     dfu = {}
-    for key in keys:
+    for key in wpan:
         dfw = wpan[key]
         dfs = span[key]
-        dfu[key] = u_(dfw, shock=dfs, aggL=out_ser.ix[key]).mean()
+        aggL = float(np.squeeze(out_ser.loc[key]))
+        dfu[key] = u_(dfw, shock=dfs, aggL=aggL).mean()
 
     dfu = tuple_constructor(dfu)
     if by_lam:
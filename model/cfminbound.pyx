@@ -1,15 +1,21 @@
-# cython: profile=True
+# cython: profile=True, cpow=True
 
-cdef extern from "/usr/include/math.h":
+cdef extern from "/usr/include/math.h" nogil:
     double sqrt(double x)
     double fabs(double)
     int signbit(double)
     double fmaxf(double, double)
     int copysign(int, double)
+    double fmax(double, double)
+    double NAN
 
 import numpy as np
 cimport cython
 cimport numpy as np
+from cython.parallel cimport prange
+
+# Default tolerance of cfminbound.  Used to check the slope at a bound.
+DEF XTOL = .00001
 
 cdef inline double ch_(double x, double shock, object w,
                     double pi, double aggL, double beta=.97, double eta=2.5, double gamma=0.5):
@@ -153,7 +159,8 @@ ctypedef np.double_t DTYPE_t
 @cython.wraparound(False)
 cpdef opt_loop(np.ndarray[DTYPE_t, ndim=3] vals, np.ndarray[DTYPE_t, ndim=1] w_grid,
                np.ndarray[DTYPE_t, ndim=1] z_grid, object w, double pi,
-               double lambda_, double aggL):
+               double lambda_, double aggL, bint monotone=False,
+               int row_start=0, int row_stop=-1):
     """
     This is the double loop at the heart of the optimization problem.
 
@@ -164,6 +171,15 @@ cpdef opt_loop(np.ndarray[DTYPE_t, ndim=3] vals, np.ndarray[DTYPE_t, ndim=1] w_g
         (wage, z_grid, convex combo of vals, free val, restricted val)
     w_grid : ndarray :: discrete set of wages
     z_grid : ndarray :: discrete set of shocks.
+    monotone : bool :: Use the structure of the restricted problem
+        to skip most of its searches.  If the free wage m1 is above
+        y it is also the restricted optimum.  If it's below y and the
+        objective is increasing at y the constraint binds.  Otherwise
+        search, starting no lower than the restricted wage for the
+        previous (smaller) shock.
+    row_start, row_stop : int :: Only fill rows [row_start, row_stop).
+        row_stop=-1 means through the last row.  Rows other than
+        0 need row 0 to be filled already.
 
     Returns
     -------
@@ -179,7 +195,9 @@ cpdef opt_loop(np.ndarray[DTYPE_t, ndim=3] vals, np.ndarray[DTYPE_t, ndim=1] w_g
 
         double y, z, m1, m2, value
 
-    for i in range(ngrid):
+    if row_stop < 0:
+        row_stop = ngrid
+    for i in range(row_start, row_stop):
         y = w_grid[i]
         for j in range(nshock):
             z = z_grid[j]
@@ -188,7 +206,16 @@ cpdef opt_loop(np.ndarray[DTYPE_t, ndim=3] vals, np.ndarray[DTYPE_t, ndim=1] w_g
                 m1 = cfminbound(0, w_max, w, z, pi, aggL)
             else:
                 m1 = vals[0, j, 3]
-            m2 = cfminbound(y, w_max, w, z, pi, aggL)
+            if not monotone:
+                m2 = cfminbound(y, w_max, w, z, pi, aggL)
+            elif y <= m1:
+                m2 = m1
+            elif ch_(y, z, w, pi, aggL) <= ch_(y + XTOL, z, w, pi, aggL):
+                m2 = y
+            elif j > 0:
+                m2 = cfminbound(fmax(y, vals[i, j - 1, 4]), w_max, w, z, pi, aggL)
+            else:
+                m2 = cfminbound(y, w_max, w, z, pi, aggL)
             value = -1 * ((1 - lambda_) * ch_(m1, z, w, pi, aggL) + lambda_ * ch_(m2, z, w, pi, aggL))
             if np.isnan(value):
                 raise ValueError
@@ -199,3 +226,289 @@ cpdef opt_loop(np.ndarray[DTYPE_t, ndim=3] vals, np.ndarray[DTYPE_t, ndim=1] w_g
             vals[i, j, 4] = m2
 
     return vals
+
+#-----------------------------------------------------------------------------
+# Native kernel.  Same optimization as above, but the value function is
+# evaluated from its knots in C so the loop never needs the GIL.
+
+# Kinds of interpolation understood by interp_c
+DEF LINEAR = 0   # interp1d(kind='linear'); nan outside the knots.
+DEF CUBIC = 1    # Hermite form of interp1d(kind='cubic'); nan outside.
+DEF PCHIP = 2    # Hermite form of pchip; extrapolates.
+
+cdef struct knots_t:
+    double *X
+    double *Y
+    double *D  # slopes at the knots. Unused for LINEAR.
+    int n
+    int kind
+
+
+def interp_knots(w):
+    """
+    Unpack an Interp into the arrays used by opt_loop_c.
+
+    Parameters
+    ----------
+    w : Interp with kind 'linear', 'cubic', or 'pchip'.
+
+    Returns
+    -------
+
+    X, Y, D : contiguous ndarrays :: knots, values, and slopes at the knots.
+    kind : int :: code for interp_c.
+    """
+    X = np.ascontiguousarray(w.X, dtype=DTYPE)
+    Y = np.ascontiguousarray(w.Y, dtype=DTYPE)
+    if w.kind == 'linear':
+        return X, Y, np.zeros_like(X), LINEAR
+    elif w.kind == 'cubic':
+        return X, Y, np.ascontiguousarray(w.slopes(), dtype=DTYPE), CUBIC
+    elif w.kind == 'pchip':
+        return X, Y, np.ascontiguousarray(w.slopes(), dtype=DTYPE), PCHIP
+    else:
+        raise ValueError("kind must be one of 'linear', 'cubic', or "
+                         "'pchip'. Got {} instead.".format(w.kind))
+
+
+cdef inline double interp_c(double x, knots_t *w) noexcept nogil:
+    """
+    Evaluate the interpolant described by w at x.
+    """
+    cdef:
+        int lo = 0
+        int hi = w.n - 1
+        int mid
+        double h, t, t2, t3
+
+    if x < w.X[0] or x > w.X[hi]:
+        if w.kind != PCHIP:
+            return NAN
+        if x > w.X[hi]:
+            lo = hi - 1
+    else:
+        # bisect for X[lo] <= x < X[lo + 1]
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if w.X[mid] <= x:
+                lo = mid
+            else:
+                hi = mid
+    hi = lo + 1
+
+    if w.kind == LINEAR:
+        return (w.Y[hi] - w.Y[lo]) / (w.X[hi] - w.X[lo]) * (x - w.X[lo]) + w.Y[lo]
+
+    h = w.X[hi] - w.X[lo]
+    t = (x - w.X[lo]) / h
+    t2 = t * t
+    t3 = t2 * t
+    return ((2 * t3 - 3 * t2 + 1) * w.Y[lo] + (t3 - 2 * t2 + t) * h * w.D[lo] +
+            (3 * t2 - 2 * t3) * w.Y[hi] + (t3 - t2) * h * w.D[hi])
+
+
+cdef inline double ch_c(double x, double shock, knots_t *w,
+                        double pi, double aggL, double beta=.97, double eta=2.5,
+                        double gamma=0.5) noexcept nogil:
+    """
+    ch_ for the native kernel.
+    """
+    return -1 * (x ** (1 - eta) - ((gamma / (gamma + 1)) * shock * (x ** (-eta) * aggL) ** ((gamma + 1) / gamma)) + beta * interp_c(x / (1 + pi), w))
+
+
+cdef double cfminbound_c(double x1, double x2, knots_t *w,
+                         double shock, double pi, double aggL, double eta=2.5,
+                         double gamma=0.5, double beta=.97, int maxfun=500,
+                         double xtol=.00001) noexcept nogil:
+    """
+    cfminbound for the native kernel.  See cfminbound for parameters.
+    """
+    cdef:
+        double sqrt_eps = sqrt(2.2e-16)
+        double golden_mean = 0.5 * (3.0 - sqrt(5.0))
+        double a = x1
+        double b = x2
+        double fulc = a + golden_mean * (b - a)
+        double nfc = fulc
+        double xf = fulc
+        double rat = 0.0
+        double e = 0.0
+        double x = xf
+        double fx = ch_c(x, shock, w, pi, aggL, beta)
+        double fu
+        int num = 1
+
+        double ffulc = fx
+        double fnfc = fx
+        double xm = 0.5 * (a + b)
+        double tol1 = sqrt_eps * fabs(xf) + xtol / 3.0
+        double tol2 = 2.0 * tol1
+
+        int golden, si
+        double r, q, p
+
+    while (fabs(xf - xm) > (tol2 - 0.5 * (b - a))):
+        golden = 1
+        # Check for parabolic fit
+        if fabs(e) > tol1:
+            golden = 0
+            r = (xf - nfc) * (fx - ffulc)
+            q = (xf - fulc) * (fx - fnfc)
+            p = (xf - fulc) * q - (xf - nfc) * r
+            q = 2.0 * (q - r)
+            if q > 0.0:
+                p = -p
+            q = fabs(q)
+            r = e
+            e = rat
+
+            # Check for acceptability of parabola
+            if ((fabs(p) < fabs(0.5*q*r)) and (p > q*(a - xf)) and
+                    (p < q * (b - xf))):
+                rat = (p + 0.0) / q
+                x = xf + rat
+
+                if ((x - a) < tol2) or ((b - x) < tol2):
+                    si = copysign(1, xm - xf) + ((xm - xf) == 0)
+                    rat = tol1 * si
+            else:      # do a golden section step
+                golden = 1
+
+        if golden:  # Do a golden-section step
+            if xf >= xm:
+                e = a - xf
+            else:
+                e = b - xf
+            rat = golden_mean*e
+
+        si = copysign(1, rat) + (rat == 0)
+        x = xf + si * fmaxf(fabs(rat), tol1)
+        fu = ch_c(x, shock, w, pi, aggL, beta)
+        num += 1
+
+        if fu <= fx:
+            if x >= xf:
+                a = xf
+            else:
+                b = xf
+            fulc, ffulc = nfc, fnfc
+            nfc, fnfc = xf, fx
+            xf, fx = x, fu
+        else:
+            if x < xf:
+                a = x
+            else:
+                b = x
+            if (fu <= fnfc) or (nfc == xf):
+                fulc, ffulc = nfc, fnfc
+                nfc, fnfc = x, fu
+            elif (fu <= ffulc) or (fulc == xf) or (fulc == nfc):
+                fulc, ffulc = x, fu
+
+        xm = 0.5 * (a + b)
+        tol1 = sqrt_eps * fabs(xf) + xtol / 3.0
+        tol2 = 2.0 * tol1
+
+        if num >= maxfun:
+            break
+
+    return xf
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void opt_row_c(double[:, :, ::1] vals, int i, double[::1] w_grid,
+                    double[::1] z_grid, knots_t *w, double pi,
+                    double lambda_, double aggL, bint monotone) noexcept nogil:
+    """
+    Fill row i of vals.  Rows other than 0 read the free wages from row 0.
+    See opt_loop for monotone.
+    """
+    cdef:
+        int j
+        int ngrid = w_grid.shape[0]
+        int nshock = z_grid.shape[0]
+        double w_max = w_grid[ngrid - 1]
+        double y = w_grid[i]
+        double z, m1, m2
+
+    for j in range(nshock):
+        z = z_grid[j]
+        if i == 0:
+            m1 = cfminbound_c(0, w_max, w, z, pi, aggL)
+        else:
+            m1 = vals[0, j, 3]
+        if not monotone:
+            m2 = cfminbound_c(y, w_max, w, z, pi, aggL)
+        elif y <= m1:
+            m2 = m1
+        elif ch_c(y, z, w, pi, aggL) <= ch_c(y + XTOL, z, w, pi, aggL):
+            m2 = y
+        elif j > 0:
+            m2 = cfminbound_c(fmax(y, vals[i, j - 1, 4]), w_max, w, z, pi, aggL)
+        else:
+            m2 = cfminbound_c(y, w_max, w, z, pi, aggL)
+        vals[i, j, 0] = y
+        vals[i, j, 1] = z
+        vals[i, j, 2] = -1 * ((1 - lambda_) * ch_c(m1, z, w, pi, aggL) +
+                              lambda_ * ch_c(m2, z, w, pi, aggL))
+        vals[i, j, 3] = m1
+        vals[i, j, 4] = m2
+
+
+def opt_loop_c(double[:, :, ::1] vals, double[::1] w_grid,
+               double[::1] z_grid, double[::1] X, double[::1] Y,
+               double[::1] D, int kind, double pi, double lambda_,
+               double aggL, int num_threads=1, bint monotone=False,
+               int row_start=0, int row_stop=-1):
+    """
+    opt_loop with the value function given by its knots (see interp_knots).
+
+    Runs without the GIL.  Row 0 is done first since every other row
+    reuses its free wages; the remaining rows are split across
+    num_threads OpenMP threads.
+
+    Parameters
+    ----------
+    vals : ndarray :: Initially zeros; will be filled.
+        (len(w_grid) x len(z_grid) x 5)
+    w_grid : ndarray :: discrete set of wages
+    z_grid : ndarray :: discrete set of shocks.
+    X, Y, D, kind : output of interp_knots for the value function.
+    num_threads : int :: number of threads for the rows.
+    monotone : bool :: See opt_loop.
+    row_start, row_stop : int :: See opt_loop.
+
+    Returns
+    -------
+
+    vals : ndarray :: filled in values.
+    """
+    cdef:
+        int i
+        int ngrid = w_grid.shape[0]
+        int first = row_start if row_start > 0 else 1
+        knots_t w
+
+    if row_stop < 0:
+        row_stop = ngrid
+
+    w.X = &X[0]
+    w.Y = &Y[0]
+    w.D = &D[0]
+    w.n = X.shape[0]
+    w.kind = kind
+
+    with nogil:
+        if row_start == 0:
+            opt_row_c(vals, 0, w_grid, z_grid, &w, pi, lambda_, aggL,
+                      monotone)
+        for i in prange(first, row_stop, num_threads=num_threads,
+                        schedule='dynamic'):
+            opt_row_c(vals, i, w_grid, z_grid, &w, pi, lambda_, aggL,
+                      monotone)
+
+    vals_ = np.asarray(vals)
+    if np.isnan(vals_[row_start:row_stop, :, 2]).any():
+        raise ValueError
+    return vals_
@@ -28,8 +28,37 @@ class ecdf:
         self.n = len(self.observations)
 
     def __call__(self, x):
-        """Handles vectors for x"""
-        return (self.observations <= x).sum(0) / self.n
+        """
+        Handles vectors for x.  Always returns an array; a scalar x
+        gives shape (1,).
+        """
+        x = np.atleast_1d(x)
+        res = np.searchsorted(self.sorted_obs, x, side='right') / self.n
+        return np.where(np.isnan(x), 0, res)
+
+    @property
+    def sorted_obs(self):
+        """Flat sorted observations.  Built on first use."""
+        try:
+            return self._sorted_obs
+        except AttributeError:
+            # also covers ecdfs pickled before this existed.
+            self._sorted_obs = np.sort(self.observations.ravel())
+            return self._sorted_obs
+
+    def quantile(self, q):
+        """
+        Inverse of the ecdf: the smallest observation x with
+        self(x) >= q.  Handles vectors for q in [0, 1].  Use this
+        rather than inverting an Interp of the ecdf, which smooths over
+        the steps.
+        """
+        q = np.atleast_1d(q)
+        # Compare with the levels __call__ returns, k / n, rather than
+        # taking ceil(q * n), which can round up past an exact level.
+        levels = np.arange(1, self.n + 1) / self.n
+        idx = np.searchsorted(levels, q, side='left')
+        return self.sorted_obs[np.clip(idx, 0, self.n - 1)]
 
     def plot(self, ax=None, a=None, b=None, **kwargs):
 
@@ -60,6 +89,157 @@ class ecdf:
         return ax
 
 
+class WeightedEcdf(object):
+
+    def __init__(self, observations=None, weights=None, max_size=None):
+        """
+        Weighted empirical distribution function built up in chunks.
+
+        Parameters
+        ----------
+
+        observations, weights : arrays.  Optional first chunk; see update.
+        max_size : int or None.  If given, keep at most about 2 * max_size
+            points.  Merging points moves weight to the right, which can
+            only lower the ecdf; error_bound is how far.
+
+        Example
+        -------
+
+        Cross section of period 28 from sample_path, a batch at a time
+
+        >>> g = WeightedEcdf(max_size=10000)
+        >>> for seed in range(100):
+        ...     pths, shocks = sample_path(ws, params, nseries=10000,
+        ...                                nperiods=30, seed=seed)
+        ...     g.update(pths[28])
+        """
+        self.values = np.array([])
+        self.weights = np.array([])
+        self.max_size = max_size
+        self.moved = 0  # weight moved past any point by compression.
+        self._cum = None
+        if observations is not None:
+            self.update(observations, weights)
+
+    @property
+    def n(self):
+        return len(self.values)
+
+    @property
+    def total(self):
+        return self.cum[-1]
+
+    @property
+    def cum(self):
+        """Cumulative weights, starting with 0."""
+        if self._cum is None:
+            self._cum = np.concatenate([[0], np.cumsum(self.weights)])
+        return self._cum
+
+    @property
+    def error_bound(self):
+        """
+        Bound on how far below the exact weighted ecdf self(x) can be.
+        0 unless max_size is set.
+        """
+        total = self.total
+        return self.moved / total if total else 0
+
+    def update(self, observations, weights=None):
+        """
+        Add observations with weights (default 1).  Both are flattened;
+        pairs with a NaN are dropped.  Returns self.
+        """
+        obs = np.asarray(observations, dtype=float).ravel()
+        if weights is None:
+            weights = np.ones_like(obs)
+        else:
+            weights = np.asarray(weights, dtype=float).ravel()
+        keep = ~(np.isnan(obs) | np.isnan(weights))
+        self._add(obs[keep], weights[keep])
+        return self
+
+    def merge(self, other):
+        """
+        Add the contents of another WeightedEcdf.  Returns self.
+        """
+        self.moved += other.moved
+        self._add(other.values, other.weights)
+        return self
+
+    def _add(self, values, weights):
+        values = np.concatenate([self.values, values])
+        weights = np.concatenate([self.weights, weights])
+        values, idx = np.unique(values, return_inverse=True)
+        self.values = values
+        self.weights = np.bincount(idx.ravel(), weights, len(values))
+        self._cum = None
+        if self.max_size is not None and self.n > 2 * self.max_size:
+            self.compress()
+
+    def compress(self):
+        """
+        Merge runs of neighbouring points, each with about total / max_size
+        weight, into their largest point.
+        """
+        cum = self.cum
+        group = np.floor(cum[:-1] / cum[-1] * self.max_size).astype(int)
+        group = np.unique(group, return_inverse=True)[1].ravel()
+        last = np.r_[np.nonzero(np.diff(group))[0], len(group) - 1]
+        weights = np.bincount(group, self.weights)
+        # all but the last point of a group move right.
+        self.moved += (weights - self.weights[last]).max()
+        self.values = self.values[last]
+        self.weights = weights
+        self._cum = None
+
+    def __call__(self, x):
+        """
+        Handles vectors for x.  Always returns an array.
+        """
+        x = np.atleast_1d(x)
+        res = self.cum[np.searchsorted(self.values, x, side='right')]
+        return np.where(np.isnan(x), 0, res / self.total)
+
+    def quantile(self, q):
+        """
+        The smallest point x with self(x) >= q.  Handles vectors for q.
+        """
+        q = np.atleast_1d(q)
+        # Compare with the levels __call__ returns; q * total can round
+        # past them.
+        idx = np.searchsorted(self.cum[1:] / self.total, q, side='left')
+        return self.values[np.clip(idx, 0, self.n - 1)]
+
+
+def cps_ecdf(handler, col='earnings', weight='og_weight', max_size=None,
+             **kwargs):
+    """
+    WeightedEcdf of col weighted by weight, read one store at a time.
+
+    Parameters
+    ----------
+
+    handler : HDFHandler (data_wrangling.cps_wrangling) or anything
+        with an iteritems giving (key, DataFrame or None).
+    col, weight : str.  Columns of each frame.
+    max_size : int or None.  See WeightedEcdf.
+    kwargs : passed to handler.iteritems.
+
+    Returns
+    -------
+
+    WeightedEcdf
+    """
+    g = WeightedEcdf(max_size=max_size)
+    for _, df in handler.iteritems(**kwargs):
+        if df is None:
+            continue
+        g.update(df[col].values, df[weight].values)
+    return g
+
+
 def is_mono(x):
     if (np.diff(x) >= 0).all():
         return True
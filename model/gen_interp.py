@@ -7,7 +7,7 @@ Wrapper for scipy's interpolation module.
 import numpy as np
 from scipy import interp
 from scipy.interpolate.polyint import PchipInterpolator
-from scipy.interpolate import interp1d, pchip
+from scipy.interpolate import interp1d, pchip, splrep, splev
 import matplotlib.pyplot as plt
 
 
@@ -74,11 +74,38 @@ class Interp(PchipInterpolator, object):
         This method makes an instance f of LinInterp callable,
         so f(z) returns the interpolation value(s) at z.
         """
+        return self._cached('interpolant', self._build_interpolant)(z)
+
+    def _build_interpolant(self):
         if self.kind == 'pchip':
-            return pchip(self.X, self.Y)(z)
+            return pchip(self.X, self.Y)
         else:
             return interp1d(self.X, self.Y, kind=self.kind,
-                            bounds_error=False)(z)
+                            bounds_error=False)
+
+    def _cached(self, name, build):
+        """
+        Return build(), computed once for the current X, Y, and kind.
+
+        Assigning new X, Y, or kind invalidates the cache.  Modifying
+        X or Y in place does not.
+        """
+        cache = self.__dict__.setdefault('_cache', {})
+        try:
+            (X, Y, kind), res = cache[name]
+            if X is self.X and Y is self.Y and kind == self.kind:
+                return res
+        except KeyError:
+            pass
+        res = build()
+        cache[name] = (self.X, self.Y, self.kind), res
+        return res
+
+    def __getstate__(self):
+        # Interpolators are rebuilt on first call after unpickling.
+        state = self.__dict__.copy()
+        state.pop('_cache', None)
+        return state
 
     def __add__(self, other):
         assert (self.X == other.X).all()
@@ -98,6 +125,25 @@ class Interp(PchipInterpolator, object):
 
         return ax.plot(self.X, self.Y, **kwargs)
 
+    def slopes(self):
+        """
+        Derivative of the interpolant at each knot in X.
+
+        Together with X and Y these define the interpolant as a piecewise
+        cubic Hermite polynomial.  Only for kind 'cubic' (not-a-knot
+        spline, like interp1d) or 'pchip'.
+        """
+        X = np.asarray(self.X, dtype='float64')
+        Y = np.asarray(self.Y, dtype='float64')
+        if self.kind == 'cubic':
+            build = lambda: splev(X, splrep(X, Y, k=3, s=0), der=1)
+        elif self.kind == 'pchip':
+            build = lambda: pchip_slopes(X, Y)
+        else:
+            raise ValueError("slopes only defined for kind 'cubic' or "
+                             "'pchip'. Got {} instead.".format(self.kind))
+        return self._cached('slopes', build)
+
     def inverse(self, kind=None):
         if kind is None:
             kind = self.kind
@@ -107,3 +153,79 @@ class Interp(PchipInterpolator, object):
             return Interp(np.sort(self.Y), self.X, kind=kind)
         else:
             raise ValueError("Cannot resort Y to invert.")
+
+
+def pchip_slopes(X, Y):
+    """
+    Knot derivatives of the monotone piecewise cubic interpolant.
+
+    Fritsch-Carlson weighted harmonic means in the interior and the
+    shape-preserving three point formula at the ends, as in scipy's
+    PchipInterpolator.
+    """
+    h = np.diff(X)
+    m = np.diff(Y) / h
+    d = np.zeros_like(Y)
+    if len(X) == 2:
+        d[:] = m[0]
+        return d
+
+    w1 = 2 * h[1:] + h[:-1]
+    w2 = h[1:] + 2 * h[:-1]
+    flat = ((np.sign(m[1:]) != np.sign(m[:-1])) | (m[1:] == 0) |
+            (m[:-1] == 0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        whmean = (w1 / m[:-1] + w2 / m[1:]) / (w1 + w2)
+        d[1:-1] = np.where(flat, 0.0, 1.0 / whmean)
+
+    def edge(h0, h1, m0, m1):
+        d = ((2 * h0 + h1) * m0 - h0 * m1) / (h0 + h1)
+        if np.sign(d) != np.sign(m0):
+            d = 0.0
+        elif np.sign(m0) != np.sign(m1) and abs(d) > abs(3 * m0):
+            d = 3 * m0
+        return d
+
+    d[0] = edge(h[0], h[1], m[0], m[1])
+    d[-1] = edge(h[-1], h[-2], m[-1], m[-2])
+    return d
+
+
+def stack_interps(interps):
+    """
+    A callable that evaluates every interpolant in interps at the same
+    points, returning an array with shape (len(interps),) + z.shape.
+
+    Interps with the same kind and X are evaluated together by one
+    interpolant over their stacked Y, so the setup and the search for
+    each point's interval happen once per group instead of once per
+    Interp.  Anything else is called on its own.
+    """
+    groups = {}
+    singles = []
+    for k, f in enumerate(interps):
+        if isinstance(f, Interp):
+            X = np.asarray(f.X, dtype='float64')
+            groups.setdefault((f.kind, X.tobytes()), (X, []))[1].append(k)
+        else:
+            singles.append(([k], f))
+
+    parts = []
+    for (kind, _), (X, idx) in groups.items():
+        Y = np.array([np.asarray(interps[k].Y, dtype='float64')
+                      for k in idx])
+        if kind == 'pchip':
+            parts.append((idx, pchip(X, Y, axis=1)))
+        else:
+            parts.append((idx, interp1d(X, Y, kind=kind,
+                                        bounds_error=False)))
+    parts.extend(singles)
+
+    def evaluate(z):
+        z = np.asarray(z, dtype='float64')
+        out = np.empty((len(interps),) + z.shape)
+        for idx, f in parts:
+            out[idx] = f(z)
+        return out
+
+    return evaluate
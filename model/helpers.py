@@ -12,11 +12,15 @@ API CHANGES:
 from __future__ import division
 
 import json
+from multiprocessing import Pool
 
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.optimize import fminbound
 from scipy import stats
+from scipy.special import ndtr, ndtri
+
+from gen_interp import stack_interps
 
 np.random.seed(42)
 #-----------------------------------------------------------------------------
@@ -31,6 +35,128 @@ def maximizer(h_, a, b, args=()):
 def maximum(h_, a, b, args=()):
     return -1 * float(h_(fminbound(h_, a, b, args=args), *args))
 
+
+def vec_fminbound(func, x1, x2, args=(), xtol=1e-5, maxfun=500):
+    """
+    Brent's bounded minimization run on many problems at once.
+
+    Follows the same steps as `cfminbound.cfminbound` (and so
+    scipy's fminbound), but every quantity is an array with one entry
+    per problem.  Each iteration makes a single call to `func` with
+    the trial points of the problems that have not yet converged.
+
+    Parameters
+    ----------
+
+    func : callable func(x, *args) -> array.  Vectorized objective.
+    x1 : array of lower bounds.
+    x2 : array of upper bounds.
+    args : tuple of arrays.  Broadcast against the bounds and sliced
+        along with x so that func only sees the active problems.
+    xtol : tolerance
+    maxfun : maximum number of function evaluations per problem.
+
+    Returns
+    -------
+
+    xf : array of minimizers, same shape as x1.
+    """
+    arrays = np.broadcast_arrays(np.asarray(x1, dtype='float64'),
+                                 np.asarray(x2, dtype='float64'), *args)
+    x1, x2 = arrays[:2]
+    shape = x1.shape
+    args = [arg.ravel() for arg in arrays[2:]]
+
+    sqrt_eps = np.sqrt(2.2e-16)
+    golden_mean = 0.5 * (3.0 - np.sqrt(5.0))
+    a = x1.ravel().copy()
+    b = x2.ravel().copy()
+    fulc = a + golden_mean * (b - a)
+    nfc, xf = fulc.copy(), fulc.copy()
+    rat = np.zeros_like(a)
+    e = np.zeros_like(a)
+    fx = np.asarray(func(xf, *args), dtype='float64')
+    num = 1
+    ffulc, fnfc = fx.copy(), fx.copy()
+    xm = 0.5 * (a + b)
+    tol1 = sqrt_eps * np.abs(xf) + xtol / 3.0
+    tol2 = 2.0 * tol1
+
+    active = np.flatnonzero(np.abs(xf - xm) > (tol2 - 0.5 * (b - a)))
+    while len(active) and num < maxfun:
+        # Work on the unconverged problems only.
+        a_, b_, xf_, fx_ = a[active], b[active], xf[active], fx[active]
+        nfc_, fnfc_ = nfc[active], fnfc[active]
+        fulc_, ffulc_ = fulc[active], ffulc[active]
+        e_, rat_ = e[active], rat[active]
+        xm_, tol1_, tol2_ = xm[active], tol1[active], tol2[active]
+
+        # Check for parabolic fit
+        parabolic = np.abs(e_) > tol1_
+        r = (xf_ - nfc_) * (fx_ - ffulc_)
+        q = (xf_ - fulc_) * (fx_ - fnfc_)
+        p = (xf_ - fulc_) * q - (xf_ - nfc_) * r
+        q = 2.0 * (q - r)
+        p = np.where(q > 0.0, -p, p)
+        q = np.abs(q)
+        r = e_
+        e_ = np.where(parabolic, rat_, e_)
+
+        # Check for acceptability of parabola
+        with np.errstate(divide='ignore', invalid='ignore'):
+            accept = (parabolic & (np.abs(p) < np.abs(0.5 * q * r)) &
+                      (p > q * (a_ - xf_)) & (p < q * (b_ - xf_)))
+            para_rat = np.where(accept, p / q, rat_)
+        x = xf_ + para_rat
+        too_close = accept & (((x - a_) < tol2_) | ((b_ - x) < tol2_))
+        si = np.copysign(1, xm_ - xf_) + ((xm_ - xf_) == 0)
+        para_rat = np.where(too_close, tol1_ * si, para_rat)
+
+        # Do a golden-section step
+        golden = ~accept
+        e_ = np.where(golden, np.where(xf_ >= xm_, a_ - xf_, b_ - xf_), e_)
+        rat_ = np.where(golden, golden_mean * e_, para_rat)
+
+        si = np.copysign(1, rat_) + (rat_ == 0)
+        x = xf_ + si * np.maximum(np.abs(rat_), tol1_)
+        fu = np.asarray(func(x, *[arg[active] for arg in args]),
+                        dtype='float64')
+        num += 1
+
+        better = fu <= fx_
+        # fu <= fx: shrink toward xf and shift the three best points.
+        a_ = np.where(better & (x >= xf_), xf_,
+                      np.where(~better & (x < xf_), x, a_))
+        b_ = np.where(better & (x < xf_), xf_,
+                      np.where(~better & (x >= xf_), x, b_))
+        # fu > fx: x might still replace nfc or fulc.
+        repl_nfc = ~better & ((fu <= fnfc_) | (nfc_ == xf_))
+        repl_fulc = (~better & ~repl_nfc &
+                     ((fu <= ffulc_) | (fulc_ == xf_) | (fulc_ == nfc_)))
+
+        new_fulc = np.where(better | repl_nfc, nfc_,
+                            np.where(repl_fulc, x, fulc_))
+        new_ffulc = np.where(better | repl_nfc, fnfc_,
+                             np.where(repl_fulc, fu, ffulc_))
+        new_nfc = np.where(better, xf_, np.where(repl_nfc, x, nfc_))
+        new_fnfc = np.where(better, fx_, np.where(repl_nfc, fu, fnfc_))
+        xf_ = np.where(better, x, xf_)
+        fx_ = np.where(better, fu, fx_)
+
+        xm_ = 0.5 * (a_ + b_)
+        tol1_ = sqrt_eps * np.abs(xf_) + xtol / 3.0
+        tol2_ = 2.0 * tol1_
+
+        a[active], b[active], xf[active], fx[active] = a_, b_, xf_, fx_
+        nfc[active], fnfc[active] = new_nfc, new_fnfc
+        fulc[active], ffulc[active] = new_fulc, new_ffulc
+        e[active], rat[active] = e_, rat_
+        xm[active], tol1[active], tol2[active] = xm_, tol1_, tol2_
+
+        active = active[np.abs(xf_ - xm_) > (tol2_ - 0.5 * (b_ - a_))]
+
+    return xf.reshape(shape)
+
 #----------------------------------------------------------------------------
 # Parameters
 #----------------------------------------------------------------------------
@@ -40,14 +166,6 @@ def load_params(pth='parameters.json'):
     with open(pth) as f:
         params = json.load(f)
 
-    wl = params['wl'][0]
-    wu = params['wu'][0]
-    wn = params['wn'][0]
-    w_grid = np.linspace(wl, wu, wn)
-    w_grid_fine = np.linspace(wl, wu, 10000)
-    params['w_grid'] = w_grid, 'Wage support.'
-    params['w_grid_fine'] = w_grid_fine, 'Finer wage support'
-
     sigma = params['sigma'][0]
     mu = -(sigma ** 2) / 2
     params['mu'] = mu, 'mean of underlying nomral distribution.'
@@ -61,17 +179,95 @@ def load_params(pth='parameters.json'):
     params['ln_dist_lb'] = ln_dist_lb, "lower bound of lognorm dist."
     params['ln_dist_ub'] = ln_dist_ub, "upper bound of lognorm dist."
 
-    zn = params['zn'][0]
-    z_grid = np.linspace(ln_dist_lb, ln_dist_ub, zn)
+    return set_grids(params)
+
+
+def set_grids(params, wn=None, zn=None):
+    """
+    Set the wage and shock grids in params.  Needs the bounds set by
+    load_params.
+
+    Parameters
+    ----------
+
+    params : dict
+    wn : int. Number of wage grid points.  Defaults to params['wn'].
+    zn : int. Number of shock grid points.  Defaults to params['zn'].
+
+    Returns
+    -------
+
+    params : the same dict, modified in place.
+    """
+    if wn is None:
+        wn = params['wn'][0]
+    if zn is None:
+        zn = params['zn'][0]
+    params['wn'] = wn, params['wn'][1]
+    params['zn'] = zn, params['zn'][1]
+
+    wl = params['wl'][0]
+    wu = params['wu'][0]
+    w_grid = np.linspace(wl, wu, wn)
+    w_grid_fine = np.linspace(wl, wu, 10000)
+    params['w_grid'] = w_grid, 'Wage support.'
+    params['w_grid_fine'] = w_grid_fine, 'Finer wage support'
+
+    ln_dist_lb = params['ln_dist_lb'][0]
+    ln_dist_ub = params['ln_dist_ub'][0]
+    rule = params.get('shock_quad', ('grid',))[0]
+    if rule == 'grid':
+        z_grid = np.linspace(ln_dist_lb, ln_dist_ub, zn)
+        params.pop('z_weights', None)
+    else:
+        z_grid, z_weights = shock_quadrature(params, zn, rule=rule)
+        params['z_weights'] = z_weights, "Quadrature weights on z_grid."
     params['z_grid'] = z_grid, "Trucnated support of shocks."
     params['z_grid_fine'] = (np.linspace(ln_dist_lb, ln_dist_ub, zn),
                              "Finer shock support,")
-
     return params
 
 
+def shock_quadrature(params, n, rule='legendre'):
+    """
+    Nodes and weights for expectations over the lognormal shocks.
+
+    Parameters
+    ----------
+
+    params : dict.  Needs mu and sigma, and for legendre ln_dist_lb and
+        ln_dist_ub.
+    n : int. Number of nodes.
+    rule : one of:
+                -legendre :: Gauss-Legendre in log(z) on
+                    [ln_dist_lb, ln_dist_ub], weighted by the normal pdf.
+                    Matches the truncated support of the grid.
+                -hermite :: Gauss-Hermite on the untruncated distribution.
+                    The outer nodes are far in the tails, past what a
+                    non-extrapolating wage schedule covers.
+
+    Returns
+    -------
+
+    z : array of shock nodes, increasing.
+    weights : array, summing to 1.
+    """
+    mu, sigma = params['mu'][0], params['sigma'][0]
+    if rule == 'legendre':
+        lo, hi = np.log(params['ln_dist_lb'][0]), np.log(params['ln_dist_ub'][0])
+        x, w = np.polynomial.legendre.leggauss(n)
+        x = (hi - lo) / 2 * x + (hi + lo) / 2
+        w = w * stats.norm(mu, sigma).pdf(x)
+    elif rule == 'hermite':
+        x, w = np.polynomial.hermite.hermgauss(n)
+        x = mu + np.sqrt(2) * sigma * x
+    else:
+        raise ValueError("rule must be one of 'legendre' or 'hermite'.")
+    return np.exp(x), w / w.sum()
+
+
 def truncated_draw(params, lower=.005, upper=.995, kind='lognorm',
-                   size=1000, samples=1):
+                   size=1000, samples=1, rng=None, method='inverse'):
     """
     Return a new normal distribution that is truncated given a
     lower upper tail in probabilities.
@@ -89,6 +285,19 @@ def truncated_draw(params, lower=.005, upper=.995, kind='lognorm',
     samples: Number of independent draws of size size to take.
         i.e. samples is the number of individuals while
         size is the number of periods.
+    rng : np.random.Generator or None.  Draw from rng rather than the
+        global state.
+    method : how uniforms are drawn.  One of
+                -inverse :: pseudo random, through the inverse cdf.
+                -halton :: randomly shifted van der Corput (1-d Halton)
+                    sequence.
+                -sobol :: scrambled 1-d Sobol sequence, the first
+                    size * samples points of the next power of two.
+                    Needs scipy.stats.qmc.
+                -scipy :: stats.truncnorm.rvs.
+        The quasi random methods fill the draws in order as one
+        sequence, so they suit a single cross section (samples=1), as in
+        get_rigid_output, rather than sample paths.
 
     Returns
     -------
@@ -105,9 +314,35 @@ def truncated_draw(params, lower=.005, upper=.995, kind='lognorm',
     where mu is -(sigma**2) / 2.
     """
     mu, sigma = params['mu'][0], params['sigma'][0]
-    n_dist = stats.norm(mu, sigma)
-    a, b = n_dist.ppf([lower, upper])
-    truncated = stats.truncnorm(a, b, loc=mu, scale=sigma).rvs([size, samples])
+    shape = [size, samples]
+    if method == 'scipy':
+        n_dist = stats.norm(mu, sigma)
+        a, b = n_dist.ppf([lower, upper])
+        truncated = stats.truncnorm(a, b, loc=mu, scale=sigma).rvs(
+            shape, random_state=rng)
+    else:
+        if method == 'inverse':
+            if rng is None:
+                q = np.random.random_sample(shape)
+            else:
+                q = rng.random(shape)
+        elif method == 'halton':
+            shift = np.random.random_sample() if rng is None else rng.random()
+            q = (halton(size * samples).ravel() + shift) % 1
+        elif method == 'sobol':
+            from scipy.stats import qmc
+            seed = np.random.randint(2 ** 31) if rng is None else rng
+            # Sobol points are only balanced in blocks of 2 ** m, so draw
+            # the next power of two and keep the first n.
+            n = size * samples
+            m = int(np.ceil(np.log2(n))) if n > 1 else 0
+            q = qmc.Sobol(1, seed=seed).random_base2(m).ravel()[:n]
+        else:
+            raise ValueError("method must be one of 'inverse', 'halton', "
+                             "'sobol', or 'scipy'.")
+        cdf_a, cdf_b = _truncated_cdf_bounds(mu, sigma, lower, upper)
+        truncated = mu + sigma * ndtri(cdf_a + q * (cdf_b - cdf_a))
+        truncated = truncated.reshape(shape)
     if kind == 'lognorm':
         return np.exp(truncated)
     elif kind == 'norm':
@@ -116,6 +351,55 @@ def truncated_draw(params, lower=.005, upper=.995, kind='lognorm',
         raise ValueError("kind must be one of 'norm' or 'lognorm'.")
 
 
+_cdf_bounds = {}
+
+
+def _truncated_cdf_bounds(mu, sigma, lower, upper):
+    """
+    Standard normal cdf at the bounds truncnorm gets in truncated_draw,
+    cached.
+
+    Those bounds are the lower and upper quantiles of norm(mu, sigma), but
+    truncnorm reads them in standard units.  Kept as is so the draws match
+    stats.truncnorm.rvs.
+    """
+    key = (mu, sigma, lower, upper)
+    if key not in _cdf_bounds:
+        a, b = mu + sigma * ndtri(np.array([lower, upper]))
+        _cdf_bounds[key] = ndtr(a), ndtr(b)
+    return _cdf_bounds[key]
+
+
+def halton(n, d=1, start=1):
+    """
+    First n points of the d dimensional Halton sequence, starting from
+    index start.  Dimension i uses the radical inverse in the i-th prime
+    base.
+
+    Returns
+    -------
+
+    array with shape n x d.
+    """
+    primes = []
+    k = 2
+    while len(primes) < d:
+        if all(k % p for p in primes):
+            primes.append(k)
+        k += 1
+
+    idx = np.arange(start, start + n)
+    out = np.zeros([n, d])
+    for j, base in enumerate(primes):
+        i = idx.copy()
+        f = 1 / base
+        while i.any():
+            out[:, j] += f * (i % base)
+            i //= base
+            f /= base
+    return out
+
+
 def clean_shocks(new_shocks, calibrated_shocks):
     new_shocks[new_shocks < calibrated_shocks[0]] = calibrated_shocks[0]
     new_shocks[new_shocks > calibrated_shocks[-1]] = calibrated_shocks[-1]
@@ -170,7 +454,7 @@ def ss_wage_flexible(params, shock=None, nperiods=30, nseries=1):
 
 
 def sample_path(ws, params, lambda_=None, w0=.9, nseries=1, nperiods=1000,
-                seed=42):
+                seed=42, rng=None):
     """
     Given a wage schedule, simulate the sample path of length nseries.
 
@@ -180,6 +464,9 @@ def sample_path(ws, params, lambda_=None, w0=.9, nseries=1, nperiods=1000,
 
     seed allows for setting a seed by passing an int.
 
+    rng is an optional np.random.Generator to draw from instead of the
+    global state; seed is then ignored.  See simulate.
+
     Returns
     -------
 
@@ -187,34 +474,170 @@ def sample_path(ws, params, lambda_=None, w0=.9, nseries=1, nperiods=1000,
     shocks: shocks that generated those choices.  Same shape.
     """
     # TODO: Change to idio shock rather than same for everyone
-    if seed:
-        if isinstance(seed, int):
-            np.random.seed(seed)
-        else:  # Say a bool, defaults to 42.
-            np.random.seed(42)
-
-    shocks = truncated_draw(params, size=nperiods, samples=nseries)
+    if rng is None:
+        if seed:
+            if isinstance(seed, int):
+                np.random.seed(seed)
+            else:  # Say a bool, defaults to 42.
+                np.random.seed(42)
+        rng = np.random
+
+    shocks = truncated_draw(params, size=nperiods, samples=nseries,
+                            rng=None if rng is np.random else rng)
     if lambda_ is None:
         lambda_ = params['lambda_'][0]
-    cannot_change_arr = np.random.uniform(0, 1, [nperiods, nseries]) < lambda_
+    cannot_change_arr = rng.uniform(0, 1, [nperiods, nseries]) < lambda_
 
-    # initialize as empty.  Fill first row with values from w, the initial wage
-    vals = np.empty([nperiods, nseries])
+    # Everyone's free choice at once, then step through the periods.
+    # Someone who cannot change earns the max of last period's wage and
+    # their free choice; others (cannot_change is 0) earn the free choice.
+    # All updates are in place, into vals and one row of scratch.
+    vals = np.asarray(ws(shocks.ravel()), dtype=float).reshape(shocks.shape)
     w = np.ones_like(vals[0, :]) * w0
-    vals[0] = w
-
-    # To vectorize, we take nseries draws from unif and check if less than lamb
-    # If greater, cannot_change is 0, so 0 * p2 is 0, so they always choose
-    # ws(shock), i.e. they are free to choose whatever.
+    p2 = np.empty_like(w)
 
-    for i, shock in enumerate(shocks):
-        cannot_change = cannot_change_arr[i]
-        p1 = ws(shock)
-        p2 = cannot_change * np.amax([w, ws(shock)], axis=0)
-        vals[i] = np.amax([p1, p2], axis=0)
+    for i in range(nperiods):
+        np.maximum(w, vals[i], out=p2)
+        p2 *= cannot_change_arr[i]
+        np.maximum(vals[i], p2, out=vals[i])
         w = vals[i]
 
-    return np.array(vals), shocks
+    return vals, shocks
+
+
+def sample_panel(wses, params, lambdas, w0=.9, nseries=1, nperiods=1000,
+                 seed=42, rng=None, consumers=(), keep=True):
+    """
+    sample_path for several economies at once.  They share the shocks
+    and the uniform draws that decide who cannot change their wage, so
+    economy k gets what sample_path(wses[k], params, lambda_=lambdas[k])
+    would with the same seed, up to rounding.  The wage schedules are
+    evaluated together by gen_interp.stack_interps and each period is
+    one step on (economies x nseries) arrays.
+
+    Parameters
+    ----------
+
+    wses : sequence of wage schedules.
+    lambdas : sequence of rigidities, one per wage schedule.
+    params, w0, nseries, nperiods, seed, rng : See sample_path.
+    consumers : iterable of callables.  Each is called as
+        f(i, vals_i, shocks_i) for every period i, where vals_i is
+        economies x nseries.
+    keep : bool.  Return every period.  Otherwise only the shocks and
+        a few periods of wages are held in memory.
+
+    Returns
+    -------
+
+    vals : array of wages chosen with shape
+        economies x nperiods x nseries if keep, else None.
+    shocks : shocks that generated those choices.  nperiods x nseries.
+    """
+    if rng is None:
+        if seed:
+            if isinstance(seed, int):
+                np.random.seed(seed)
+            else:  # Say a bool, defaults to 42.
+                np.random.seed(42)
+        rng = np.random
+
+    shocks = truncated_draw(params, size=nperiods, samples=nseries,
+                            rng=None if rng is np.random else rng)
+    uniforms = rng.uniform(0, 1, [nperiods, nseries])
+    lambdas = np.asarray(lambdas, dtype=float)[:, np.newaxis]
+
+    shape = (len(wses), nseries)
+    wages = stack_interps(wses)
+    if keep:
+        vals = wages(shocks)
+    else:
+        vals = None
+    w = np.ones(shape) * w0
+    p2 = np.empty(shape)
+
+    # As in sample_path, with the economies stacked.
+    for i in range(nperiods):
+        free = vals[:, i] if keep else wages(shocks[i])
+        np.maximum(w, free, out=p2)
+        p2 *= uniforms[i] < lambdas
+        np.maximum(free, p2, out=free)
+        w = free
+        for f in consumers:
+            f(i, w, shocks[i])
+
+    return vals, shocks
+
+
+def _simulate_block(args):
+    ws, params, lambda_, w0, nseries, nperiods, seed_seq = args
+    return sample_path(ws, params, lambda_=lambda_, w0=w0, nseries=nseries,
+                       nperiods=nperiods, rng=np.random.default_rng(seed_seq))
+
+
+def simulate(ws, params, nseries, nperiods, seed=42, block_size=10000,
+             n_jobs=1, consumers=(), lambda_=None, w0=.9, keep=False):
+    """
+    sample_path for many series, in blocks.
+
+    The series are split into blocks of block_size.  Each block draws
+    from its own Generator, seeded by a child of SeedSequence(seed), so
+    the results only depend on seed and block_size, not on n_jobs.
+
+    Parameters
+    ----------
+
+    ws, params, lambda_, w0, nperiods : See sample_path.
+    nseries : int.  Total number of series.
+    seed : int.
+    block_size : int.  Series per block.
+    n_jobs : int.  Blocks are simulated by a pool of n_jobs processes
+        if greater than 1.
+    consumers : iterable of callables.  Each is called as
+        f(i, vals_i, shocks_i) with the period i cross-section of every
+        block, block by block and within a block period by period, so a
+        period arrives in pieces of block_size series.  e.g.
+        lambda i, vals, shocks: i == 28 and g.update(vals) for a
+        WeightedEcdf g.
+    keep : bool.  Return all the blocks joined together.
+
+    Returns
+    -------
+
+    vals, shocks : arrays with shape nperiods x nseries if keep, else
+        None and None.
+    """
+    sizes = [block_size] * (nseries // block_size)
+    if nseries % block_size:
+        sizes.append(nseries % block_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(ws, params, lambda_, w0, size, nperiods, seed_seq)
+             for size, seed_seq in zip(sizes, seeds)]
+
+    if n_jobs > 1:
+        pool = Pool(n_jobs)
+        blocks = pool.imap(_simulate_block, tasks)
+    else:
+        pool = None
+        blocks = (_simulate_block(task) for task in tasks)
+
+    kept = []
+    try:
+        for vals, shocks in blocks:
+            for i in range(nperiods):
+                for f in consumers:
+                    f(i, vals[i], shocks[i])
+            if keep:
+                kept.append((vals, shocks))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if keep:
+        return (np.hstack([v for v, _ in kept]),
+                np.hstack([s for _, s in kept]))
+    return None, None
 
 
 def cln_shocks(params, shocks=None, size=10000, lower=.005, upper=.995):
@@ -11,6 +11,7 @@ import numpy as np
 import pandas as pd
 
 import analyze_run as ar
+from fast_kde import BinnedKDE
 from helpers import load_params, sample_path
 
 
@@ -35,12 +36,13 @@ def get_index(df):
 
 
 def plot_wage_change_dist(df, pi, lambda_, nperiods=4, log=True, figkwargs=None,
-                          axkwargs=None):
+                          axkwargs=None, kde=True):
     """
     Make and save the figure for the distribution of wage changes.
 
     figkwargs is a dict passed to the fig constructor.
     axkwargs is a dict passed to the axes constructor.
+    kde draws a BinnedKDE of each lag over its histogram.
     """
     idx = get_index(df)
     SOME_SS = 30  # just some period in the steady state.
@@ -66,6 +68,11 @@ def plot_wage_change_dist(df, pi, lambda_, nperiods=4, log=True, figkwargs=None,
     cts, idx, other = hist(t.values, histtype='bar', bins=idx,
                            label=['lag={}'.format(i) for i in diffs],
                            ax=ax, normed=True, **_axkwargs)
+    if kde:
+        xs = np.linspace(idx[0], idx[-1], 500)
+        for lag, bars in zip(diffs, other):
+            ax.plot(xs, BinnedKDE(t[lag].dropna()).pdf(xs),
+                    color=bars[0].get_facecolor(), alpha=1)
 
     ax.set_title('Across Periods{0} $\pi={1:.3f}$, $\lambda={2:.3f}$'.format(
         strlog, pi, lambda_))
@@ -89,10 +96,9 @@ def make_and_save(pi, lambda_, wses=None, nperiods=4, log=True, figkwargs=None,
 
     Returns an axes and does IO.
     """
+    params = load_params()
     if wses is None:
-        params = load_params()
-        all_files = ar.get_all_files(params)
-        wses = ar.read_output(all_files, kind='ws')
+        wses = ar.load_results('ws', params)
 
     df = get_df(pi, lambda_, wses[pi, lambda_], params)
     fig, ax = plot_wage_change_dist(df, pi, lambda_, nperiods=nperiods,
@@ -104,14 +110,13 @@ def make_and_save(pi, lambda_, wses=None, nperiods=4, log=True, figkwargs=None,
 
 def main():
     params = load_params()
-    all_files = ar.get_all_files(params)
-    wses = ar.read_output(all_files, kind='ws')
+    wses = ar.load_results('ws', params)
     keys = wses.keys()
     pis, lambdas = zip(*keys)  # FTW
     pis_u, lambdas_u = sorted(set(pis)), sorted(set(lambdas))  # unique
 
     for pi, lambda_ in keys:
-        make_and_save(pi, lambda_)
+        make_and_save(pi, lambda_, wses=wses)
         print('Saved {}, {}'.format(pi, lambda_))
 
 if __name__ == '__main__':
@@ -0,0 +1,220 @@
+"""
+Consolidated store of solved economies.
+
+A single HDF5 file (a pandas HDFStore in table format) holds every run
+of a sweep.  Each kind of result is a long table keyed by pi, lambda_
+(exact floats) and iteration (the outer output iteration; FINAL for the
+result written to results/):
+
+    scalars : one row per run.  rigid_out, aggL, and the kinds of the
+        value function and wage schedule interpolants.
+    vf, ws : x and y, the interpolation points.
+    gp : obs, the observations behind the wage ECDF.
+    rest : the columns of label_vals(rest).
+
+The keys are data columns, so a select reads only the matching rows,
+and columns= limits it to the columns needed.  Loading a whole sweep is
+one select per table instead of a file open per point.
+
+HDF5 files can't take concurrent writers, so writes hold an exclusive
+lock on a .lock file next to the store and reads a shared one.
+"""
+from __future__ import division
+
+from contextlib import contextmanager
+import fcntl
+import os
+
+import numpy as np
+import pandas as pd
+
+from ecdf import ecdf
+from gen_interp import Interp
+from value_function import label_vals
+
+
+FINAL = -1
+KEYS = ['pi', 'lambda_', 'iteration']
+TABLES = ('scalars', 'vf', 'ws', 'gp', 'rest')
+
+
+class ResultStore(object):
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+
+        path : str.  The HDF5 file; created on the first append.
+        """
+        self.path = path
+        self.lock_path = path + '.lock'
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Store at params['result_store'] under params['results_path'].
+        None if result_store is empty or missing.
+        """
+        fname = params.get('result_store', ('',))[0]
+        if not fname:
+            return None
+        return cls(os.path.join(params.get('results_path', ('',))[0], fname))
+
+    @contextmanager
+    def _locked(self, shared=False):
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def append(self, res_dict, pi, lambda_, iteration=FINAL):
+        """
+        Add the Tv, ws, gp, rest, rigid_out, and aggL (if any) of
+        res_dict as (pi, lambda_, iteration), replacing rows already
+        stored under that key.
+        """
+        frames = to_frames(res_dict, pi, lambda_, iteration)
+        where = _where(pi, lambda_, iteration)
+        with self._locked():
+            store = pd.HDFStore(self.path, complevel=5, complib='blosc')
+            try:
+                # scalars has one row per run, so it's a cheap check for
+                # a rerun before scanning the big tables.
+                rerun = ('scalars' in store and
+                         len(store.select_as_coordinates('scalars', where)))
+                for name in TABLES:
+                    if rerun and name in store:
+                        store.remove(name, where=where)
+                    store.append(name, frames[name], data_columns=KEYS,
+                                 index=False,
+                                 min_itemsize={'vf_kind': 8, 'ws_kind': 8}
+                                 if name == 'scalars' else None)
+            finally:
+                store.close()
+
+    def select(self, table, pi=None, lambda_=None, iteration=FINAL,
+               columns=None):
+        """
+        Rows of table matching the keys given.  None matches every value
+        of that key.
+
+        Parameters
+        ----------
+
+        table : str.  One of TABLES.
+        pi, lambda_ : float or None.
+        iteration : int or None.
+        columns : list of str or None.  Read only these (and the keys).
+
+        Returns
+        -------
+
+        DataFrame with the key columns first.
+        """
+        if table not in TABLES:
+            raise ValueError("table must be one of {}. Got {} "
+                             "instead.".format(TABLES, table))
+        if columns is not None:
+            columns = KEYS + [c for c in columns if c not in KEYS]
+        with self._locked(shared=True):
+            store = pd.HDFStore(self.path, mode='r')
+            try:
+                df = store.select(table, where=_where(pi, lambda_, iteration),
+                                  columns=columns)
+            finally:
+                store.close()
+        return df.reset_index(drop=True)
+
+    def load(self, kind, pi=None, lambda_=None, iteration=FINAL):
+        """
+        Rebuild results as analyze_run.read_output does from the
+        separate files.
+
+        Parameters
+        ----------
+
+        kind : str.  One of
+            - rigid_output :: float for output
+            - vf :: Interp for value function
+            - ws :: Interp for wage schedule
+            - gp :: ecdf for wage dist
+            - rest :: DataFrame as from label_vals
+        pi, lambda_, iteration : as in select.  Give iteration when
+            loading more than one, or the keys will clash.
+
+        Returns
+        -------
+
+        dict of {(pi, lambda_): result}
+        """
+        if kind == 'rigid_output':
+            df = self.select('scalars', pi, lambda_, iteration,
+                             columns=['rigid_out'])
+            return {(p, l): v for p, l, v in
+                    zip(df.pi, df.lambda_, df.rigid_out)}
+        elif kind in ('vf', 'ws'):
+            kinds = self.select('scalars', pi, lambda_, iteration,
+                                columns=[kind + '_kind'])
+            kinds = {(p, l): k for p, l, k in
+                     zip(kinds.pi, kinds.lambda_, kinds[kind + '_kind'])}
+            df = self.select(kind, pi, lambda_, iteration)
+            return {key: Interp(g.x.values, g.y.values, kind=kinds[key])
+                    for key, g in df.groupby(['pi', 'lambda_'], sort=False)}
+        elif kind == 'gp':
+            df = self.select('gp', pi, lambda_, iteration)
+            return {key: ecdf(g.obs.values)
+                    for key, g in df.groupby(['pi', 'lambda_'], sort=False)}
+        elif kind == 'rest':
+            df = self.select('rest', pi, lambda_, iteration)
+            res = {}
+            for key, g in df.groupby(['pi', 'lambda_'], sort=False):
+                g = g.drop(KEYS, axis=1)
+                g.index = pd.MultiIndex.from_arrays(
+                    [g.wage.values, g.z_grid.values],
+                    names=['w_grid', 'z_grid'])
+                res[key] = g
+            return res
+        else:
+            raise ValueError("kind must be one of 'rigid_output', 'vf', "
+                             "'ws', 'gp', or 'rest'. Got {} "
+                             "instead.".format(kind))
+
+
+def to_frames(res_dict, pi, lambda_, iteration=FINAL):
+    """
+    The rows res_dict adds to each table, as a dict of DataFrames.
+    """
+    def keyed(df):
+        df.insert(0, 'iteration', int(iteration))
+        df.insert(0, 'lambda_', float(lambda_))
+        df.insert(0, 'pi', float(pi))
+        return df
+
+    Tv, ws = res_dict['Tv'], res_dict['ws']
+    scalars = pd.DataFrame({'rigid_out': [float(res_dict['rigid_out'])],
+                            'aggL': [float(res_dict.get('aggL', np.nan))],
+                            'vf_kind': [Tv.kind], 'ws_kind': [ws.kind]},
+                           columns=['rigid_out', 'aggL', 'vf_kind',
+                                    'ws_kind'])
+    rest = label_vals(res_dict['rest']).reset_index(drop=True)
+    return {'scalars': keyed(scalars),
+            'vf': keyed(pd.DataFrame({'x': np.asarray(Tv.X, dtype=float),
+                                      'y': np.asarray(Tv.Y, dtype=float)})),
+            'ws': keyed(pd.DataFrame({'x': np.asarray(ws.X, dtype=float),
+                                      'y': np.asarray(ws.Y, dtype=float)})),
+            'gp': keyed(pd.DataFrame({'obs': res_dict['gp'].sorted_obs})),
+            'rest': keyed(rest)}
+
+
+def _where(pi=None, lambda_=None, iteration=None):
+    # repr round trips floats exactly
+    terms = ['{} == {!r}'.format(col, conv(val)) for col, val, conv in
+             (('pi', pi, float), ('lambda_', lambda_, float),
+              ('iteration', iteration, int)) if val is not None]
+    return terms or None
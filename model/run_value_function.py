@@ -10,13 +10,15 @@ import os
 import pickle
 import shutil
 
-from helpers import load_params, ss_wage_flexible, sample_path, ss_output_flexible
-from joblib import Parallel, delayed
+from helpers import (load_params, ss_wage_flexible, sample_path,
+                     ss_output_flexible, set_grids)
 import numpy as np
 
 from ecdf import ecdf
 from gen_interp import Interp
-from value_function import get_rigid_output, iter_bellman
+from result_store import FINAL, ResultStore
+from solution_cache import SolutionCache
+from value_function import get_rigid_output, iter_bellman, label_vals
 
 
 class BellmanRunner(object):
@@ -33,13 +35,18 @@ class BellmanRunner(object):
 
         params['call_dir'] = os.getcwd(), 'Path from which the script was called.'
         self.params = params
+        self.cache = SolutionCache.from_params(params)
+        self.store = ResultStore.from_params(params)
 
         self.res_by_run = []
         self.res_by_cat = defaultdict(list)
 
     def __call__(self):
         res_dict = self.generate_res_input()
-        res_dict = run_one(self.params, res_dict=res_dict)
+        if res_dict is None and self.params.get('multigrid', ([],))[0]:
+            res_dict = run_multigrid(self.params)
+        else:
+            res_dict = run_one(self.params, res_dict=res_dict)
         return res_dict
 
     def generate_res_input(self):
@@ -48,9 +55,13 @@ class BellmanRunner(object):
 
         If alternating use that.  If monotonic use the last one. Could
         *generalitze* filtering down to alternating and take the mean of that.
+
+        The first run starts from the nearest cached solution, if any.
         """
         if len(self.res_by_run) == 0:
             res_dict = None
+            if self.cache is not None:
+                res_dict = self.cache.nearest(self.pi, self.lambda_)
         elif len(self.res_by_run) == 1:
             res_dict = self.res_by_run[0]
         else:
@@ -62,10 +73,11 @@ class BellmanRunner(object):
                 out = np.mean(outs)
                 Y = np.mean([v.Y for v in Tvs], axis=0)
                 v = Interp(X, Y, kind='linear')
+                res_dict = {'Tv': v, 'rigid_out': out}
             else:
-                out = outs[-1]
-                v = Tvs[-1]
-            res_dict = {'Tv': v, 'rigid_out': out}
+                res_dict = {'Tv': Tvs[-1], 'rigid_out': outs[-1],
+                            'aggL': self.last['aggL'],
+                            'solve_stats': self.last['solve_stats']}
 
         return res_dict
 
@@ -88,28 +100,139 @@ class BellmanRunner(object):
         self.res_by_cat['rigid_out'].append(res_dict['rigid_out'])
         self.last = res_dict
 
-    def iter_over_output(self, tol=.05):
-        e = 1
-        out_prior = ss_output_flexible(self.params)
-        while e > tol:
+    def iter_over_output(self, tol=None, method=None, maxiter=None):
+        """
+        Solve for the output that run_one reproduces, i.e. a root of
+        F(aggL) - aggL, with F(aggL) the rigid_out of a run at aggL.
+
+        Parameters
+        ----------
+
+        tol : float.  Stop once |F(aggL) - aggL| < tol.
+        method : str.  One of
+            - substitution :: aggL <- F(aggL), with generate_res_input's
+                averaging.
+            - secant :: secant steps, bisecting once a sign change
+                brackets the root.
+            - steffensen :: Aitken extrapolation of two substitution steps.
+        maxiter : int.  Most runs of run_one.
+
+        tol, method, and maxiter default to params' outer_tol, outer_method,
+        and outer_maxiter.  Each run after the first starts from the last
+        Tv.  self.history holds (aggL, F(aggL)) for every run.
+        """
+        params = self.params
+        if tol is None:
+            tol = params.get('outer_tol', (.05,))[0]
+        if method is None:
+            method = params.get('outer_method', ('substitution',))[0]
+        if maxiter is None:
+            maxiter = params.get('outer_maxiter', (50,))[0]
+        self.history = []
+
+        res_dict = self.generate_res_input()
+        if res_dict is None:
+            out_prior = ss_output_flexible(params)
+        else:
+            out_prior = res_dict['rigid_out']
+
+        if method == 'substitution':
+            e = 1
+            while e > tol and len(self.history) < maxiter:
+                res_dict = self()
+                self.update(res_dict)
+                out = res_dict['rigid_out']
+                self.history.append((out_prior, out))
+                e = np.abs(out_prior - out)
+                print('The new error is {}'.format(e))
+                out_prior = out
+        elif method in ('secant', 'steffensen'):
             res_dict = self()
             self.update(res_dict)
-            out = res_dict['rigid_out']
-            e = np.abs(out_prior - out)
-            print('The new error is {}'.format(e))
-            out_prior = out
+            self.history.append((out_prior, res_dict['rigid_out']))
+            e = self._solve_output(tol, method, maxiter)
+        else:
+            raise ValueError("method must be one of 'substitution', "
+                             "'secant', or 'steffensen'.")
+        self.terminating_e = e
+        print('Outer history for pi={}, lambda={} (aggL, rigid_out): '
+              '{}'.format(self.pi, self.lambda_, self.history))
+        if self.cache is not None:
+            self.cache.store(self.pi, self.lambda_, self.last)
+
+    def eval_output(self, aggL):
+        """
+        rigid_out from one run of run_one at aggL, starting from the last
+        Tv.  Updates the instance and self.history.
+        """
+        res_dict = run_one(self.params, res_dict={
+            'Tv': self.last['Tv'], 'rigid_out': aggL,
+            'aggL': self.last['aggL'],
+            'solve_stats': self.last['solve_stats']})
+        self.update(res_dict)
+        out = res_dict['rigid_out']
+        self.history.append((aggL, out))
+        print('aggL={}, rigid_out={}, error={}'.format(aggL, out,
+                                                       np.abs(out - aggL)))
+        return out
+
+    def _solve_output(self, tol, method, maxiter):
+        """
+        Secant or Steffensen iteration from the first point in
+        self.history.  Returns the last |F(aggL) - aggL|.
+        """
+        x0, fx0 = self.history[-1]
+        r0 = fx0 - x0
+        if method == 'secant':
+            x1 = fx0
+            r1 = self.eval_output(x1) - x1
+            while np.abs(r1) >= tol and len(self.history) < maxiter:
+                if r1 != r0:
+                    x2 = x1 - r1 * (x1 - x0) / (r1 - r0)
+                else:
+                    x2 = x1 + r1
+                pos = [x for x, fx in self.history if fx - x > 0]
+                neg = [x for x, fx in self.history if fx - x < 0]
+                if pos and neg:
+                    # nearest points on each side of the root
+                    a = min(pos, key=lambda x: np.abs(x - x1))
+                    b = min(neg, key=lambda x: np.abs(x - x1))
+                    if not min(a, b) < x2 < max(a, b):
+                        x2 = (a + b) / 2
+                x0, r0 = x1, r1
+                x1 = x2
+                r1 = self.eval_output(x1) - x1
+            return np.abs(r1)
         else:
-            self.terminating_e = e
+            x, fx = x0, fx0
+            while np.abs(fx - x) >= tol and len(self.history) < maxiter:
+                ffx = self.eval_output(fx)
+                if np.abs(ffx - fx) < tol:
+                    return np.abs(ffx - fx)
+                denom = ffx - 2 * fx + x
+                if denom != 0:
+                    x = x - (fx - x) ** 2 / denom
+                else:
+                    x = ffx
+                fx = self.eval_output(x)
+            return np.abs(fx - x)
 
     def write_results(self):
         """
         Writes last one to results/
-        and others to results/intermediate/
+        and others to results/intermediate/.  All of them also go to the
+        result store, if there is one, with the others at their
+        iteration.
+
+        Returns the paths written for the last one.
         """
         res_dict = self.last
-        write_results(res_dict, self.pi, self.lambda_)
+        paths = write_results(res_dict, self.pi, self.lambda_,
+                              store=self.store)
         for i, d in enumerate(self.res_by_run):
-            write_results(d, self.pi, self.lambda_, intermediate=True, i=i)
+            write_results(d, self.pi, self.lambda_, intermediate=True, i=i,
+                          store=self.store)
+        return paths
 
 
 def iter_bellman_wrapper(hyperparams):
@@ -137,6 +260,13 @@ def run_one(params, res_dict=None):
     a dictionary of results.
 
     For the first loop leave res_dict as None.
+
+    Normally the value function is solved with linear interpolation first
+    and then finished with cubic.  If res_dict holds a cubic Tv that met
+    the tolerance at an aggL within params['warm_start_dist'] of this
+    one, the linear stage is skipped, and the cubic stage runs to the
+    tighter tolerance given by warm_tol.  res_dict['solve_stats'] holds
+    the iteration info for each stage run.
     """
     pi = params['pi'][0]
     # lambda_ = params['lambda_'][0]
@@ -144,6 +274,7 @@ def run_one(params, res_dict=None):
     np.random.seed(42)
     w_grid = params['w_grid'][0]
     z_grid = params['z_grid'][0]
+    tol = 0.005
 
     if res_dict:
         print("Reusing res_dict.")
@@ -152,13 +283,34 @@ def run_one(params, res_dict=None):
     else:
         v = Interp(w_grid, -w_grid + 27.3, kind='linear')
         out = ss_output_flexible(params)  # ss output w/ flexible wages
-    # Get close with linear first.  Then do a few cubic to finish up
-    Tv, ws, rest = iter_bellman(v, tol=0.005, strict=False, log=False,
-                                params=params, pi=pi, aggL=out, kind='linear')
-    Tvc = Interp(Tv.X, Tv.Y, kind='cubic')
-    Tv, ws, rest = iter_bellman(Tvc, tol=0.005, strict=False, log=False,
-                                params=params, pi=pi, aggL=out)
-    res_dict = {'Tv': Tv, 'ws': ws, 'rest': rest}
+    opts = solver_options(params)
+    stats = []
+    if is_warm(res_dict, out, tol, params.get('warm_start_dist', (0,))[0]):
+        info = {'kind': 'cubic', 'stage': 'warm'}
+        Tv, ws, rest = iter_bellman(v, tol=warm_tol(res_dict, out, tol,
+                                                    params),
+                                    strict=False, log=False,
+                                    params=params, pi=pi, aggL=out,
+                                    info=info, **opts)
+        stats.append(info)
+    else:
+        # Get close with linear first.  Then do a few cubic to finish up
+        lin_info = {'kind': 'linear', 'stage': 'linear'}
+        cub_info = {'kind': 'cubic', 'stage': 'cubic'}
+        Tv, ws, rest = iter_bellman(v, tol=tol, strict=False, log=False,
+                                    params=params, pi=pi, aggL=out,
+                                    kind='linear', info=lin_info, **opts)
+        Tvc = Interp(Tv.X, Tv.Y, kind='cubic')
+        Tv, ws, rest = iter_bellman(Tvc, tol=tol, strict=False, log=False,
+                                    params=params, pi=pi, aggL=out,
+                                    info=cub_info, **opts)
+        stats.extend([lin_info, cub_info])
+    print("Solved pi={}, lambda={} in {} iterations ({:.1f}s).".format(
+          pi, params['lambda_'][0],
+          ' + '.join('{} {}'.format(s['n_iter'], s['stage']) for s in stats),
+          sum(s['time'] for s in stats)))
+    res_dict = {'Tv': Tv, 'ws': ws, 'rest': rest, 'aggL': out,
+                'solve_stats': stats}
     flex_ws = Interp(z_grid, ss_wage_flexible(params, shock=z_grid))
     #-------------------------------------------------------------------------
     pths, shks = sample_path(ws, params, nseries=1000, nperiods=30)
@@ -172,13 +324,121 @@ def run_one(params, res_dict=None):
     return res_dict
 
 
-def write_results(res_dict, pi, lambda_, intermediate=False, i=''):
+def is_warm(res_dict, aggL, tol, dist):
+    """
+    Whether res_dict can start run_one at aggL without the linear stage:
+    its Tv is cubic, its last stage met tol, and it was solved at an aggL
+    within dist of this one.
+    """
+    if not res_dict or 'aggL' not in res_dict:
+        return False
+    stats = res_dict.get('solve_stats') or [{}]
+    return (res_dict['Tv'].kind == 'cubic' and
+            stats[-1].get('error', np.inf) < tol and
+            np.abs(res_dict['aggL'] - aggL) <= dist)
+
+
+def warm_tol(res_dict, aggL, tol, params):
+    """
+    Tolerance for a warm started run at aggL: params['warm_tol_scale']
+    times how far aggL moved from res_dict's, kept between
+    params['warm_tol_min'] and tol.  As the outer iteration settles on
+    its fixed point the value function is solved more tightly.
+    """
+    scale = params.get('warm_tol_scale', (0,))[0]
+    tol_min = params.get('warm_tol_min', (tol,))[0]
+    dist = np.abs(res_dict['aggL'] - aggL)
+    return float(np.clip(scale * dist, min(tol_min, tol), tol))
+
+
+def run_multigrid(params, res_dict=None):
+    """
+    run_one on a sequence of grids, coarse to fine.  Each level starts
+    from the last level's Tv, interpolated onto its wage grid, and
+    rigid_out.
+
+    The levels are the (wn, zn) pairs in params['multigrid'] followed by
+    params' own wn and zn.  Once rigid_out changes by less than
+    params['multigrid_tol'] between levels the remaining coarse levels
+    are skipped, but the last level, on params' own grids, is always
+    solved.
+
+    Parameters
+    ----------
+
+    params : dict.  Unchanged; each level works on a copy.
+    res_dict : dict.  Optional warm start for the first level.
+
+    Returns
+    -------
+
+    res_dict : dict.  From the last level, on params' grids.
+        res_dict['multigrid'] holds (wn, zn, rigid_out) for each level
+        solved.
+    """
+    schedule = [tuple(level) for level in params.get('multigrid', ([],))[0]]
+    schedule.append((params['wn'][0], params['zn'][0]))
+    tol = params.get('multigrid_tol', (0,))[0]
+
+    levels, stats = [], []
+    converged = False
+    for i, (wn, zn) in enumerate(schedule):
+        if converged and i < len(schedule) - 1:
+            continue
+        level_params = set_grids(dict(params), wn=wn, zn=zn)
+        if res_dict is not None:
+            w_grid = level_params['w_grid'][0]
+            Tv = res_dict['Tv']
+            res_dict = {'Tv': Interp(w_grid, Tv(w_grid), kind=Tv.kind),
+                        'rigid_out': res_dict['rigid_out']}
+        res_dict = run_one(level_params, res_dict=res_dict)
+        for level_stats in res_dict['solve_stats']:
+            level_stats.update(wn=wn, zn=zn)
+        stats.extend(res_dict['solve_stats'])
+        levels.append((wn, zn, res_dict['rigid_out']))
+        if len(levels) > 1 and abs(levels[-1][2] - levels[-2][2]) < tol:
+            converged = True
+
+    print("Multigrid levels (wn, zn, rigid_out): {}".format(levels))
+    res_dict['solve_stats'] = stats
+    res_dict['multigrid'] = levels
+    return res_dict
+
+
+def solver_options(params):
+    """
+    Keyword arguments for iter_bellman (and through it bellman) taken
+    from params.  Missing entries fall back to plain value function
+    iteration.
+    """
+    accelerate = params.get('accelerate', (None,))[0]
+    if accelerate == 'none':
+        accelerate = None
+    return {'howard_steps': params.get('howard_steps', (0,))[0],
+            'accelerate': accelerate,
+            'anderson_m': params.get('anderson_m', (5,))[0],
+            'mqp': params.get('mqp', (False,))[0],
+            'monotone': params.get('monotone', (False,))[0],
+            'method': params.get('method', ('cython',))[0],
+            'backend': params.get('backend', (None,))[0],
+            'n_jobs': params.get('n_jobs', (1,))[0]}
+
+
+def write_results(res_dict, pi, lambda_, intermediate=False, i='',
+                  store=None):
     """
     Handle the file writing of iter_bellman.
 
     Parameters
     ----------
+
+    store : ResultStore or None.  Also append res_dict here, at
+        iteration i if intermediate and FINAL otherwise.
     """
+    if store is not None:
+        store.append(res_dict, pi, lambda_,
+                     iteration=i if intermediate else FINAL)
+
     piname = str(pi).replace('.', '')
     lname = str(lambda_).replace('.', '')
     out_name = '_'.join([piname, lname])
@@ -190,17 +450,29 @@ def write_results(res_dict, pi, lambda_, intermediate=False, i=''):
         mid = ''
         i = ''
 
-    with open('results/' + mid + 'vf_' + out_name + i + '.pkl', 'w') as f:
+    pre = 'results/' + mid
+    paths = [pre + 'vf_' + out_name + i + '.pkl',
+             pre + 'ws_' + out_name + i + '.pkl',
+             pre + 'gp_' + out_name + i + '.pkl',
+             pre + 'rigid_output_' + out_name + i + '_.txt',
+             pre + 'results_' + out_name + i + '.h5']
+    with open(paths[0], 'w') as f:
         pickle.dump(res_dict['Tv'], f)
-    with open('results/' + mid + 'ws_' + out_name + i + '.pkl', 'w') as f:
+    with open(paths[1], 'w') as f:
         pickle.dump(res_dict['ws'], f)
-    with open('results/' + mid + 'gp_' + out_name + i + '.pkl', 'w') as f:
+    with open(paths[2], 'w') as f:
         pickle.dump(res_dict['gp'], f)
-    with open('results/' + mid + 'rigid_output_' + out_name + i + '_.txt', 'w') as f:
+    with open(paths[3], 'w') as f:
         f.write(str(res_dict['rigid_out']))
-    res_dict['rest'].to_hdf('results/' + mid + 'results_' + out_name + i + '.h5',
-                            'pi_' + out_name)
+    label_vals(res_dict['rest']).to_hdf(paths[4], 'pi_' + out_name)
+    if 'solve_stats' in res_dict:
+        with open('results/solve_stats.txt', 'a') as f:
+            for stats in res_dict['solve_stats']:
+                stats = dict(stats, pi=pi, lambda_=lambda_,
+                             intermediate=intermediate, i=i)
+                f.write(json.dumps(stats) + '\n')
     print('Added results for {}'.format(out_name))
+    return paths
 
 
 def unique_param_generator(params):
@@ -318,19 +590,18 @@ if __name__ == '__main__':
     except OSError:
         pass
 
-    move_prior_runs()
-    write_metadeta(params)
-
-    pi_low = params['pi_low'][0]
-    pi_high = params['pi_high'][0]
-    pi_n = params['pi_n'][0]
-    pi_grid = np.linspace(pi_low, pi_high, pi_n)
-    # Parallel(n_jobs=-1)(delayed(iter_bellman_wrapper)(unique_params)
-                        # for unique_params in unique_param_generator(params))
-    lambda_l = params['lambda_l'][0]
-    lambda_u = params['lambda_u'][0]
-    lambda_n = params['lambda_n'][0]
-    lambda_grid = np.linspace(lambda_l, lambda_u, lambda_n)
-    hyperspace = itertools.product(pi_grid, lambda_grid)
-    Parallel(n_jobs=-1)(delayed(iter_bellman_wrapper)(tup)
-                        for tup in hyperspace)
+    # The ledger records finished points, so a restarted sweep picks up
+    # where it left off.  Only a new sweep moves old results aside.
+    from sweep import adaptive_sweep, run_sweep
+    ledger_path = os.path.join('results', 'sweep.db')
+    if not os.path.exists(ledger_path):
+        move_prior_runs()
+        write_metadeta(params)
+
+    budget = params.get('sweep_budget', (0,))[0]
+    if budget:
+        adaptive_sweep(params, ledger_path, budget,
+                       batch=params['refine_batch'][0],
+                       tol=params['refine_tol'][0], n_jobs=-1)
+    else:
+        run_sweep(params, ledger_path, n_jobs=-1)
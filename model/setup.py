@@ -4,6 +4,8 @@
 # import numpy as np
 # setup(
 #     cmdclass={'build_ext': build_ext},
-#     ext_modules=[Extension("cfminbound", ["cfminbound.pyx"])],
+#     ext_modules=[Extension("cfminbound", ["cfminbound.pyx"],
+#                            extra_compile_args=['-fopenmp'],
+#                            extra_link_args=['-fopenmp'])],
 #     include_dirs=[np.get_include()]
 # )
@@ -0,0 +1,144 @@
+"""
+On disk cache of solved economies, used to warm start BellmanRunner.
+
+Solutions are grouped by a hash of the parameters that change the model
+(everything but pi and lambda_).  Within a group each (pi, lambda_) gets
+its own pickle of Tv, ws and rigid_out, so a sweep over a new
+(pi, lambda_) grid can start from the nearest solved point.
+"""
+from __future__ import division
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+import numpy as np
+
+
+MODEL_KEYS = ('eta', 'gamma', 'beta', 'sigma', 'w_grid', 'z_grid')
+
+
+def params_hash(params, keys=MODEL_KEYS):
+    """
+    Hash of the values of params[k] for k in keys.  Arrays are hashed
+    by their values.
+    """
+    vals = {k: np.asarray(params[k][0], dtype=float).tolist() for k in keys}
+    return hashlib.sha1(json.dumps(vals, sort_keys=True).encode()).hexdigest()
+
+
+class SolutionCache(object):
+
+    def __init__(self, cache_dir, params, max_entries=500):
+        """
+        Parameters
+        ----------
+
+        cache_dir : str.  Shared by all models; created on the first
+            store.
+        params : dict.  Picks out the model's group; see params_hash.
+        max_entries : int.  Least recently used entries beyond this many,
+            counted over every group, are removed.
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.path = os.path.join(cache_dir, params_hash(params))
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        Cache at params['cache_dir'] under params['results_path'],
+        holding params['cache_size'] entries.  None if cache_dir is empty
+        or missing.
+        """
+        cache_dir = params.get('cache_dir', ('',))[0]
+        if not cache_dir:
+            return None
+        cache_dir = os.path.join(params.get('results_path', ('',))[0],
+                                 cache_dir)
+        return cls(cache_dir, params,
+                   max_entries=params.get('cache_size', (500,))[0])
+
+    def _fname(self, pi, lambda_):
+        return os.path.join(self.path, '{!r}_{!r}.pkl'.format(float(pi),
+                                                             float(lambda_)))
+
+    def keys(self):
+        """
+        (pi, lambda_) pairs in this model's group.
+        """
+        if not os.path.isdir(self.path):
+            return []
+        keys = []
+        for f in os.listdir(self.path):
+            if f.endswith('.pkl'):
+                pi, lambda_ = f[:-len('.pkl')].split('_')
+                keys.append((float(pi), float(lambda_)))
+        return keys
+
+    def get(self, pi, lambda_):
+        """
+        The cached dict with keys Tv, ws, rigid_out, pi, and lambda_, or
+        None.
+        """
+        fname = self._fname(pi, lambda_)
+        try:
+            with open(fname, 'rb') as f:
+                res = pickle.load(f)
+            os.utime(fname, None)
+        except (IOError, OSError, EOFError):
+            return None
+        return res
+
+    def nearest(self, pi, lambda_):
+        """
+        The entry closest to (pi, lambda_), or None if the group is empty.
+        """
+        keys = self.keys()
+        if not keys:
+            return None
+        dist = [np.hypot(p - pi, l - lambda_) for p, l in keys]
+        return self.get(*keys[int(np.argmin(dist))])
+
+    def store(self, pi, lambda_, res_dict):
+        """
+        Save Tv, ws, and rigid_out from res_dict for (pi, lambda_),
+        then evict.
+        """
+        res = {'Tv': res_dict['Tv'], 'ws': res_dict['ws'],
+               'rigid_out': res_dict['rigid_out'], 'pi': pi,
+               'lambda_': lambda_}
+        try:
+            os.makedirs(self.path)
+        except OSError:
+            pass
+        # write then rename so parallel runs never see a partial file.
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(res, f)
+        os.rename(tmp, self._fname(pi, lambda_))
+        self.evict()
+
+    def evict(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        entries = []
+        for group in os.listdir(self.cache_dir):
+            pth = os.path.join(self.cache_dir, group)
+            if not os.path.isdir(pth):
+                continue
+            for f in os.listdir(pth):
+                if f.endswith('.pkl'):
+                    fname = os.path.join(pth, f)
+                    try:
+                        entries.append((os.path.getmtime(fname), fname))
+                    except OSError:
+                        pass
+        entries.sort()
+        for _, fname in entries[:max(len(entries) - self.max_entries, 0)]:
+            try:
+                os.remove(fname)
+            except OSError:
+                pass
@@ -0,0 +1,255 @@
+"""
+Resumable sweep over the (pi, lambda_) hyperspace.
+
+Each point is a row in an sqlite ledger that records its state
+(pending, running, done, or failed), attempts, timings, rigid output,
+and the files it wrote.  Restarting a sweep with the same ledger skips
+the points that are done and reruns the rest, most expensive first.
+
+adaptive_sweep starts from the grid in params and then adds points
+where the output surface is least well interpolated; see refine_points.
+"""
+from __future__ import division
+
+import itertools
+import json
+import sqlite3
+import time
+import traceback
+
+from joblib import Parallel, delayed
+import numpy as np
+from scipy.interpolate import griddata
+from scipy.spatial import Delaunay
+
+
+class SweepLedger(object):
+
+    def __init__(self, path):
+        """
+        Open the ledger at path, creating it if needed.  Every process
+        should open its own.
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=60)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "pi REAL, lambda_ REAL, state TEXT, attempts INTEGER, "
+                "started REAL, finished REAL, seconds REAL, outputs TEXT, "
+                "error TEXT, rigid_out REAL, PRIMARY KEY (pi, lambda_))")
+
+    def add(self, points):
+        """
+        Add (pi, lambda_) points as pending.  Points already in the ledger
+        are left alone.
+        """
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO jobs (pi, lambda_, state, attempts) "
+                "VALUES (?, ?, 'pending', 0)",
+                [(float(pi), float(lambda_)) for pi, lambda_ in points])
+
+    def jobs(self, state=None):
+        """
+        Rows as dicts, optionally only those in state.
+        """
+        query = "SELECT * FROM jobs"
+        args = ()
+        if state is not None:
+            query += " WHERE state = ?"
+            args = (state,)
+        cur = self.conn.execute(query, args)
+        cols = [c[0] for c in cur.description]
+        return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+    def schedule(self, max_attempts=3):
+        """
+        (pi, lambda_) points still to run, most expensive first.
+
+        A point is still to run unless it is done or has failed
+        max_attempts times.  Points left running by a crash count as
+        still to run.  The cost of a point is its last time if it has
+        one, and otherwise the time of the nearest point that does (0 if
+        none do).
+        """
+        rows = self.jobs()
+        timed = [(r['pi'], r['lambda_'], r['seconds']) for r in rows
+                 if r['seconds'] is not None]
+        todo = [r for r in rows if r['state'] != 'done' and
+                r['attempts'] < max_attempts]
+
+        def cost(row):
+            if row['seconds'] is not None:
+                return row['seconds']
+            if not timed:
+                return 0
+            dist = [np.hypot(p - row['pi'], l - row['lambda_'])
+                    for p, l, _ in timed]
+            return timed[int(np.argmin(dist))][2]
+
+        todo.sort(key=cost, reverse=True)
+        return [(r['pi'], r['lambda_']) for r in todo]
+
+    def start(self, pi, lambda_):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET state = 'running', attempts = attempts + 1, "
+                "started = ?, error = NULL WHERE pi = ? AND lambda_ = ?",
+                (time.time(), pi, lambda_))
+
+    def finish(self, pi, lambda_, outputs=(), rigid_out=None):
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET state = 'done', finished = ?, "
+                "seconds = ? - started, outputs = ?, rigid_out = ? "
+                "WHERE pi = ? AND lambda_ = ?",
+                (now, now, json.dumps(list(outputs)), rigid_out, pi,
+                 lambda_))
+
+    def outputs(self):
+        """
+        {(pi, lambda_): rigid_out} for the points that are done.
+        """
+        return {(r['pi'], r['lambda_']): r['rigid_out']
+                for r in self.jobs('done') if r['rigid_out'] is not None}
+
+    def fail(self, pi, lambda_, error=''):
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET state = 'failed', finished = ?, "
+                "seconds = ? - started, error = ? "
+                "WHERE pi = ? AND lambda_ = ?",
+                (now, now, error, pi, lambda_))
+
+
+def hyperspace(params):
+    """
+    (pi, lambda_) points from params' pi and lambda grids.
+    """
+    pi_grid = np.linspace(params['pi_low'][0], params['pi_high'][0],
+                          params['pi_n'][0])
+    lambda_grid = np.linspace(params['lambda_l'][0], params['lambda_u'][0],
+                              params['lambda_n'][0])
+    return list(itertools.product(pi_grid, lambda_grid))
+
+
+def run_point(ledger_path, hyperparams):
+    """
+    Solve and write one point, recording it in the ledger.  Failures are
+    recorded rather than raised so the rest of the sweep continues.
+
+    Returns True on success.
+    """
+    from run_value_function import BellmanRunner
+
+    pi, lambda_ = hyperparams
+    ledger = SweepLedger(ledger_path)
+    ledger.start(pi, lambda_)
+    try:
+        kls = BellmanRunner(hyperparams)
+        kls.iter_over_output()
+        paths = kls.write_results()
+    except Exception:
+        ledger.fail(pi, lambda_, traceback.format_exc())
+        return False
+    ledger.finish(pi, lambda_, paths, rigid_out=kls.last['rigid_out'])
+    return True
+
+
+def run_sweep(params, ledger_path, n_jobs=-1, max_attempts=3):
+    """
+    Run every point of params' hyperspace not already done in the ledger
+    at ledger_path.
+
+    Returns the number of points that succeeded this time.
+    """
+    ledger = SweepLedger(ledger_path)
+    ledger.add(hyperspace(params))
+    return _run_scheduled(ledger, n_jobs, max_attempts)
+
+
+def _run_scheduled(ledger, n_jobs, max_attempts):
+    todo = ledger.schedule(max_attempts=max_attempts)
+    print('{} points to run.'.format(len(todo)))
+    done = Parallel(n_jobs=n_jobs)(delayed(run_point)(ledger.path, tup)
+                                   for tup in todo)
+    return sum(done)
+
+
+def refine_points(outputs, bounds, n, tol=0):
+    """
+    Where to solve next to best improve the interpolated output surface.
+
+    The candidates are the midpoints of the edges of the Delaunay
+    triangulation of the solved points, in coordinates scaled to the unit
+    square by bounds.  The error at each is estimated by the gap between
+    the linear and cubic (griddata) interpolants of output.  On an edge
+    the linear interpolant is the mean of the ends, so this gap measures
+    the curvature along it.
+
+    Parameters
+    ----------
+
+    outputs : dict of {(pi, lambda_): rigid_out}.  At least 4 points,
+        not all on a line.
+    bounds : ((pi_low, pi_high), (lambda_l, lambda_u)).
+    n : int or None.  Most points to return; None for all of them.
+    tol : float.  Only return points with an estimated error above tol.
+
+    Returns
+    -------
+
+    list of (pi, lambda_), largest estimated error first.
+    """
+    (pl, ph), (ll, lu) = bounds
+    keys = list(outputs)
+    pts = np.array([((p - pl) / (ph - pl), (l - ll) / (lu - ll))
+                    for p, l in keys])
+    vals = np.array([outputs[k] for k in keys])
+
+    edges = set()
+    for simplex in Delaunay(pts).simplices:
+        for i, j in itertools.combinations(sorted(simplex), 2):
+            edges.add((i, j))
+    mids = np.array([(pts[i] + pts[j]) / 2 for i, j in sorted(edges)])
+
+    err = np.abs(griddata(pts, vals, mids, method='cubic') -
+                 griddata(pts, vals, mids, method='linear'))
+    order = [i for i in np.argsort(-err) if err[i] > tol][:n]
+    return [(pl + mids[i, 0] * (ph - pl), ll + mids[i, 1] * (lu - ll))
+            for i in order]
+
+
+def adaptive_sweep(params, ledger_path, budget, batch=4, tol=0, n_jobs=-1,
+                   max_attempts=3):
+    """
+    Solve params' hyperspace, then keep adding batch points from
+    refine_points until budget points are in the ledger or no untried
+    point has an estimated error above tol.  Resumes like run_sweep.
+
+    Returns the number of points that are done.
+    """
+    ledger = SweepLedger(ledger_path)
+    ledger.add(hyperspace(params))
+    _run_scheduled(ledger, n_jobs, max_attempts)
+    bounds = ((params['pi_low'][0], params['pi_high'][0]),
+              (params['lambda_l'][0], params['lambda_u'][0]))
+
+    while len(ledger.jobs()) < budget:
+        jobs = ledger.jobs()
+        n = min(batch, budget - len(jobs))
+        # a failed point still splits an edge of the solved points, so
+        # skip everything already tried and take the next best.
+        tried = {(r['pi'], r['lambda_']) for r in jobs}
+        new = [pt for pt in refine_points(ledger.outputs(), bounds, None,
+                                          tol=tol)
+               if pt not in tried][:n]
+        if not new:
+            break
+        ledger.add(new)
+        print('Refining at {}'.format(new))
+        _run_scheduled(ledger, n_jobs, max_attempts)
+    return len(ledger.outputs())
@@ -2,6 +2,8 @@ from __future__ import division
 
 import os
 import pickle
+import shutil
+import tempfile
 import unittest
 
 import nose
@@ -9,10 +11,10 @@ import numpy as np
 from numpy.testing import assert_equal, assert_allclose
 
 import pandas as pd
-from pandas.util.testing import (assert_frame_equal,
-                                 assert_panel_equal)
+from pandas.testing import assert_series_equal
 
-from ..analyze_run import read_output, make_panel, get_utils
+from ..analyze_run import (read_output, make_panel, get_utils, load_results,
+                           results_index, panel_stats)
 from ..gen_interp import Interp
 from ..helpers import sample_path
 
@@ -62,6 +64,25 @@ class TestAnalysis(unittest.TestCase):
         [assert_interp_equal(vf, result[x]) for x in result]
         self.assertEquals(sorted(expected.keys()), sorted(result.keys()))
 
+    def test_load_results(self):
+        pth = tempfile.mkdtemp()
+        vf = Interp([0, 1], [0, 1])
+        for fname in ['vf_001_09.pkl', 'vf_005_09.pkl', 'ws_001_09.pkl']:
+            with open(os.path.join(pth, fname), 'wb') as f:
+                pickle.dump(vf, f)
+        params = {'results_path': (pth + '/', 'a')}
+        try:
+            result = load_results('vf', params, maxsize=1)
+            self.assertEqual(sorted(result), [(.01, .9), (.05, .9)])
+            # nothing is read until it's accessed
+            os.remove(os.path.join(pth, 'vf_005_09.pkl'))
+            assert_interp_equal(vf, result[.01, .9])
+            self.assertRaises(IOError, result.__getitem__, (.05, .9))
+            # the saved index is rebuilt once the directory changes
+            self.assertEqual(list(results_index(pth)['vf']), [(.01, .9)])
+        finally:
+            shutil.rmtree(pth)
+
     def test_sample_path(self):
         X = np.array([0.70541378, 0.73997213, 0.77453049, 0.80908884, 0.84364719,
                       0.87820555, 0.9127639, 0.94732226, 0.98188061, 1.01643896,
@@ -122,8 +143,8 @@ class TestAnalysis(unittest.TestCase):
         s = np.array([0.96075536, 1.03577164, 1.006286, 0.98902403,
                       0.93358932])
         key = (0.005, 0.05)
-        wpan = pd.Panel({key: pd.DataFrame({0: x})})
-        span = pd.Panel({key: pd.DataFrame({0: s})})
+        wpan = {key: pd.DataFrame({0: x})}
+        span = {key: pd.DataFrame({0: s})}
 
         key = (0.005, 0.05)
 
@@ -134,6 +155,24 @@ class TestAnalysis(unittest.TestCase):
         expected = np.array([[-1.7002755086677428]])
         assert_equal(expected, actual)
 
+    def test_panel_stats(self):
+        z = np.linspace(0.5, 1.5, 20)
+        wses = {(0.005, 0.05): Interp(z, 0.5 + 0.4 * z, kind='cubic'),
+                (0.005, 0.5): Interp(z, 0.5 + 0.4 * z, kind='cubic'),
+                (0.02, 0.5): Interp(z, 0.6 + 0.4 * z, kind='pchip')}
+        params = {'mu': (-0.020000000000000004, 'mean.'),
+                  'sigma': [0.2, u'standard dev.']}
+        idx = pd.MultiIndex.from_tuples(sorted(wses))
+        out_ser = pd.DataFrame({0: [.8, .85, .9]}, index=idx)
+
+        wpan, span = make_panel(wses, params, nseries=20, nperiods=40)
+        diffs, utils = panel_stats(wses, params, out_ser=out_ser,
+                                   nseries=20, nperiods=40)
+        for key in wses:
+            assert_series_equal(diffs[key], wpan[key].diff().iloc[30],
+                                check_names=False)
+        assert_allclose(utils, get_utils(wpan, span, out_ser=out_ser))
+
 if __name__ == '__main__':
     nose.runmodule(argv=[__file__, '-vvs', '-x', '--pdb', '--pdb-failure'],
                    exit=False)
@@ -0,0 +1,75 @@
+from __future__ import division
+
+import unittest
+
+import numpy as np
+
+from ..ecdf import ecdf, WeightedEcdf
+
+
+class TestEcdf(unittest.TestCase):
+
+    def setUp(self):
+        obs = np.random.RandomState(0).rand(1000)
+        obs[::9] = obs[::7][:len(obs[::9])]  # ties
+        self.g = ecdf(obs)
+
+    def test_call(self):
+        g = self.g
+        x = np.concatenate([np.linspace(-.1, 1.1, 50), g.observations[:50, 0]])
+        expected = (g.observations <= x).sum(0) / g.n
+        np.testing.assert_array_equal(g(x), expected)
+        self.assertEqual(g(.5).shape, (1,))
+
+    def test_quantile(self):
+        q = np.linspace(0, 1, 101)
+        x = self.g.quantile(q)
+        self.assertTrue((self.g(x) >= q).all())
+        # exact round trip, including levels like 7 / 25 where q * n
+        # rounds up
+        for n in range(1, 200):
+            obs = np.arange(n, dtype=float)
+            g = ecdf(obs)
+            np.testing.assert_array_equal(g.quantile(g(obs)), obs)
+
+
+class TestWeightedEcdf(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.obs = np.round(rng.lognormal(size=20000), 3)
+        self.w = rng.rand(20000)
+        self.x = np.linspace(0, 6, 100)
+
+    def test_unweighted(self):
+        g, wg = ecdf(self.obs), WeightedEcdf(self.obs)
+        np.testing.assert_allclose(wg(self.x), g(self.x))
+        q = [0, .1, .5, 1]
+        np.testing.assert_array_equal(wg.quantile(q), g.quantile(q))
+
+    def test_quantile(self):
+        rng = np.random.RandomState(1)
+        for n in range(1, 200):
+            obs = np.arange(n, dtype=float)
+            for w in [np.ones(n), rng.rand(n)]:
+                g = WeightedEcdf(obs, w)
+                np.testing.assert_array_equal(g.quantile(g(obs)), obs)
+
+    def test_chunks(self):
+        expected = np.array([self.w[self.obs <= x].sum()
+                             for x in self.x]) / self.w.sum()
+        chunks = np.array_split(np.arange(len(self.obs)), 10)
+        exact = WeightedEcdf()
+        for c in chunks:
+            exact.update(self.obs[c], self.w[c])
+        np.testing.assert_allclose(exact(self.x), expected)
+
+        small = [WeightedEcdf(self.obs[c], self.w[c], max_size=100)
+                 for c in chunks]
+        g = small[0]
+        for other in small[1:]:
+            g.merge(other)
+        self.assertLessEqual(g.n, 200)
+        diff = expected - g(self.x)
+        self.assertTrue((diff > -1e-12).all())
+        self.assertTrue((diff <= g.error_bound).all())
@@ -0,0 +1,25 @@
+from __future__ import division
+
+import unittest
+
+import numpy as np
+from scipy.stats import gaussian_kde
+
+from ..fast_kde import BinnedKDE
+
+
+class TestBinnedKDE(unittest.TestCase):
+
+    def test_matches_gaussian_kde(self):
+        data = np.exp(np.random.RandomState(0).randn(1000) * .3)
+        x = np.linspace(0, 4, 100)
+        for bw in ['scott', 'silverman', .3]:
+            expected = gaussian_kde(data, bw_method=bw)
+            actual = BinnedKDE(data, bw_method=bw)
+            self.assertAlmostEqual(actual.factor, expected.factor)
+            np.testing.assert_allclose(actual.pdf(x), expected(x), atol=1e-4)
+
+    def test_outside_grid(self):
+        k = BinnedKDE([1, 2, 3])
+        self.assertEqual(k.pdf(-10)[0], 0)
+        self.assertEqual(k.evaluate([10, 20]).shape, (2,))
@@ -0,0 +1,44 @@
+from __future__ import division
+
+import pickle
+import unittest
+
+import numpy as np
+from numpy.testing import assert_array_equal
+from scipy.interpolate import interp1d, pchip
+
+from ..gen_interp import Interp
+
+
+class TestInterp(unittest.TestCase):
+
+    def setUp(self):
+        self.X = np.linspace(0.4, 3.5, 20)
+        self.Y = -self.X + 27.3 + 0.3 * np.sin(3 * self.X)
+        self.xs = np.linspace(0.3, 3.6, 34)
+
+    def expected(self, Y, kind):
+        if kind == 'pchip':
+            return pchip(self.X, Y)(self.xs)
+        else:
+            return interp1d(self.X, Y, kind=kind, bounds_error=False)(self.xs)
+
+    def test_cached_call(self):
+        for kind in ['linear', 'cubic', 'pchip']:
+            w = Interp(self.X, self.Y, kind=kind)
+            assert_array_equal(w(self.xs), self.expected(self.Y, kind))
+            # second call reuses the interpolant
+            assert_array_equal(w(self.xs), self.expected(self.Y, kind))
+
+    def test_reassign_invalidates(self):
+        w = Interp(self.X, self.Y, kind='cubic')
+        w(self.xs)
+        w.Y = 2 * self.Y
+        assert_array_equal(w(self.xs), self.expected(2 * self.Y, 'cubic'))
+
+    def test_pickle(self):
+        w = Interp(self.X, self.Y, kind='cubic')
+        w(self.xs)
+        w2 = pickle.loads(pickle.dumps(w))
+        self.assertNotIn('_cache', w2.__dict__)
+        assert_array_equal(w2(self.xs), self.expected(self.Y, 'cubic'))
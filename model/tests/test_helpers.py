@@ -2,11 +2,15 @@ from __future__ import division
 
 import json
 import unittest
+import warnings
 
 import numpy as np
+from scipy.stats import norm
 
+from ..gen_interp import Interp
 from ..helpers import (load_params, truncated_draw, ss_output_flexible,
-                       ss_wage_flexible)
+                       ss_wage_flexible, set_grids, simulate, halton,
+                       shock_quadrature, sample_path, sample_panel)
 
 
 class TestLoadParams(unittest.TestCase):
@@ -28,3 +32,101 @@ class TestLoadParams(unittest.TestCase):
         actual = ss_wage_flexible(params, shock=1)
         expected = 1.0041753592911187
         self.assertEquals(expected, actual)
+
+    def test_set_grids(self):
+        params = {'wl': (0.4, 'a'), 'wu': (3.5, 'b'), 'wn': (20, 'c'),
+                  'zn': (10, 'd'), 'ln_dist_lb': (0.5, 'e'),
+                  'ln_dist_ub': (1.5, 'f')}
+        set_grids(params, wn=5, zn=3)
+        np.testing.assert_almost_equal(params['w_grid'][0],
+                                       np.linspace(0.4, 3.5, 5))
+        np.testing.assert_almost_equal(params['z_grid'][0], [0.5, 1, 1.5])
+        self.assertEqual(params['wn'], (5, 'c'))
+
+    def test_truncated_draw(self):
+        params = {'mu': (-0.08, 'a'), 'sigma': (0.4, 'b')}
+        np.random.seed(1)
+        expected = truncated_draw(params, size=30, samples=20, method='scipy')
+        np.random.seed(1)
+        actual = truncated_draw(params, size=30, samples=20)
+        np.testing.assert_allclose(actual, expected)
+        # truncnorm reads the quantiles of norm(mu, sigma) in standard units
+        a, b = norm(-0.08, 0.4).ppf([.005, .995])
+        qmc = truncated_draw(params, size=100, method='halton')
+        self.assertEqual(qmc.shape, (100, 1))
+        self.assertTrue((qmc > np.exp(-0.08 + 0.4 * a)).all())
+        self.assertTrue((qmc < np.exp(-0.08 + 0.4 * b)).all())
+        # 100 isn't a power of 2, which Sobol.random warns about
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            qmc = truncated_draw(params, size=100, method='sobol',
+                                 rng=np.random.default_rng(0))
+        self.assertEqual(qmc.shape, (100, 1))
+        self.assertTrue((qmc < np.exp(-0.08 + 0.4 * b)).all())
+
+    def test_shock_quadrature(self):
+        sigma = 0.4
+        mu = -sigma ** 2 / 2
+        params = {'mu': (mu, 'a'), 'sigma': (sigma, 'b'),
+                  'ln_dist_lb': (np.exp(mu + sigma * norm.ppf(.05)), 'c'),
+                  'ln_dist_ub': (np.exp(mu + sigma * norm.ppf(.95)), 'd')}
+        # E[z] = 1 for the untruncated distribution
+        z, w = shock_quadrature(params, 20, rule='hermite')
+        self.assertAlmostEqual(w.dot(z), 1)
+        # E[log z] = mu; the truncation is symmetric in logs
+        z, w = shock_quadrature(params, 20, rule='legendre')
+        self.assertAlmostEqual(w.sum(), 1)
+        self.assertAlmostEqual(w.dot(np.log(z)), mu)
+        self.assertTrue((z > params['ln_dist_lb'][0]).all())
+
+    def test_halton(self):
+        expected = [[.5, 1 / 3], [.25, 2 / 3], [.75, 1 / 9]]
+        np.testing.assert_allclose(halton(3, 2), expected)
+
+    def test_simulate(self):
+        sigma = 0.4
+        params = {'mu': (-sigma ** 2 / 2, 'a'), 'sigma': (sigma, 'b'),
+                  'lambda_': (0.5, 'c')}
+        z = np.linspace(0.5, 1.5, 10)
+        ws = Interp(z, 0.5 + 0.4 * z, kind='pchip')
+        tops, periods = [], []
+
+        def consume(i, v, s):
+            periods.append(i)
+            if i == 9:
+                tops.append(v)
+
+        vals, shocks = simulate(ws, params, 250, 10, block_size=100,
+                                keep=True, consumers=[consume])
+        self.assertEqual(vals.shape, (10, 250))
+        # each of the 3 blocks, period by period
+        self.assertEqual(periods, list(range(10)) * 3)
+        np.testing.assert_array_equal(np.hstack(tops), vals[-1])
+        self.assertEqual(simulate(ws, params, 250, 10, block_size=100),
+                         (None, None))
+        pvals, pshocks = simulate(ws, params, 250, 10, block_size=100,
+                                  n_jobs=2, keep=True)
+        np.testing.assert_array_equal(vals, pvals)
+        np.testing.assert_array_equal(shocks, pshocks)
+
+    def test_sample_panel(self):
+        params = {'mu': (-0.08, 'a'), 'sigma': (0.4, 'b')}
+        z = np.linspace(0.5, 1.5, 10)
+        wses = [Interp(z, 0.5 + 0.4 * z, kind='cubic'),
+                Interp(z, 0.6 + 0.4 * z, kind='cubic'),
+                Interp(z, 0.5 + 0.4 * z, kind='pchip')]
+        lambdas = [.2, .5, .8]
+        vals, shocks = sample_panel(wses, params, lambdas, nseries=50,
+                                    nperiods=20)
+        self.assertEqual(vals.shape, (3, 20, 50))
+        for k, ws in enumerate(wses):
+            expected, _ = sample_path(ws, params, lambda_=lambdas[k],
+                                      nseries=50, nperiods=20)
+            np.testing.assert_allclose(vals[k], expected, rtol=1e-12)
+        rows = []
+        none, streamed = sample_panel(
+            wses, params, lambdas, nseries=50, nperiods=20, keep=False,
+            consumers=[lambda i, v, s: rows.append(v.copy())])
+        self.assertIsNone(none)
+        np.testing.assert_array_equal(streamed, shocks)
+        np.testing.assert_array_equal(np.stack(rows, axis=1), vals)
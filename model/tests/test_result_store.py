@@ -0,0 +1,74 @@
+from __future__ import division
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ..analyze_run import read_output
+from ..ecdf import ecdf
+from ..gen_interp import Interp
+from ..result_store import FINAL, ResultStore
+
+
+class TestResultStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = ResultStore(os.path.join(self.dir, 'store.h5'))
+        w_grid = np.linspace(0.4, 3.5, 5)
+        z_grid = np.linspace(.5, 1.5, 3)
+        rest = np.random.rand(5, 3, 5)
+        rest[:, :, 0] = w_grid[:, np.newaxis]
+        rest[:, :, 1] = z_grid
+        self.res = {'Tv': Interp(w_grid, -w_grid + 27.3, kind='cubic'),
+                    'ws': Interp(z_grid, .5 + .4 * z_grid, kind='pchip'),
+                    'gp': ecdf(np.random.rand(20)), 'rest': rest,
+                    'rigid_out': .85, 'aggL': .84}
+        # inexact in decimal on purpose
+        self.key = (0.1 + 0.2, 1 / 3)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        pi, lambda_ = self.key
+        self.store.append(self.res, pi, lambda_, iteration=0)
+        self.store.append(dict(self.res, rigid_out=.8), pi, lambda_)
+        self.assertEqual(self.store.load('rigid_output'), {self.key: .8})
+        self.assertEqual(self.store.load('rigid_output', iteration=0),
+                         {self.key: .85})
+        vf = self.store.load('vf')[self.key]
+        np.testing.assert_array_equal(vf.Y, self.res['Tv'].Y)
+        self.assertEqual(vf.kind, 'cubic')
+        self.assertEqual(self.store.load('ws')[self.key].kind, 'pchip')
+        np.testing.assert_array_equal(
+            self.store.load('gp')[self.key].sorted_obs,
+            self.res['gp'].sorted_obs)
+        rest = self.store.load('rest')[self.key]
+        np.testing.assert_array_equal(rest.values,
+                                      self.res['rest'].reshape(15, 5))
+
+    def test_append_replaces(self):
+        self.store.append(self.res, .02, .5)
+        self.store.append(dict(self.res, rigid_out=.8), .02, .5)
+        self.store.append(self.res, .02, .6)
+        df = self.store.select('scalars', columns=['rigid_out'])
+        self.assertEqual(list(df.columns),
+                         ['pi', 'lambda_', 'iteration', 'rigid_out'])
+        self.assertEqual(sorted(df.rigid_out), [.8, .85])
+        self.assertEqual(len(self.store.select('vf', lambda_=.5)), 5)
+        self.assertTrue((df.iteration == FINAL).all())
+
+    def test_read_output(self):
+        self.store.append(self.res, .02, .5)
+        cwd = os.getcwd()
+        os.chdir(self.dir)
+        try:
+            result = read_output(['store.h5', 'store.h5'],
+                                 kind='rigid_output')
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(result, {(.02, .5): .85})
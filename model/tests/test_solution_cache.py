@@ -0,0 +1,62 @@
+from __future__ import division
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ..gen_interp import Interp
+from ..solution_cache import SolutionCache, params_hash
+
+
+class TestSolutionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        w_grid = np.linspace(0.4, 3.5, 5)
+        self.params = {'eta': (2.5, 'a'), 'gamma': (0.5, 'b'),
+                       'beta': (0.97, 'c'), 'sigma': (0.4, 'd'),
+                       'w_grid': (w_grid, 'e'),
+                       'z_grid': (np.linspace(.5, 1.5, 3), 'f')}
+        self.res = {'Tv': Interp(w_grid, -w_grid + 27.3), 'ws': None,
+                    'rigid_out': .85, 'gp': None}
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_hash(self):
+        other = dict(self.params, sigma=(0.2, 'd'))
+        self.assertNotEqual(params_hash(self.params), params_hash(other))
+        same = dict(self.params, pi=(0.02, 'g'))
+        self.assertEqual(params_hash(self.params), params_hash(same))
+
+    def test_nearest(self):
+        cache = SolutionCache(self.dir, self.params)
+        self.assertIsNone(cache.nearest(.02, .5))
+        cache.store(.01, .1, self.res)
+        cache.store(.05, .9, dict(self.res, rigid_out=.8))
+        self.assertEqual(cache.nearest(.04, .8)['rigid_out'], .8)
+        self.assertEqual(cache.get(.01, .1)['rigid_out'], .85)
+        # another model doesn't see these
+        other = SolutionCache(self.dir, dict(self.params, eta=(2, 'a')))
+        self.assertIsNone(other.nearest(.04, .8))
+
+    def test_evict(self):
+        cache = SolutionCache(self.dir, self.params, max_entries=2)
+        for pi in [.01, .02, .03]:
+            cache.store(pi, .5, self.res)
+        self.assertEqual(sorted(cache.keys()), [(.02, .5), (.03, .5)])
+
+    def test_lazy_dirs(self):
+        root = os.path.join(self.dir, 'cache')
+        cache = SolutionCache.from_params(
+            dict(self.params, cache_dir=('cache', ''),
+                 results_path=(self.dir, '')))
+        self.assertEqual(cache.cache_dir, root)
+        self.assertEqual(cache.keys(), [])
+        self.assertIsNone(cache.nearest(.02, .5))
+        self.assertFalse(os.path.exists(root))
+        cache.store(.02, .5, self.res)
+        self.assertEqual(cache.keys(), [(.02, .5)])
@@ -0,0 +1,100 @@
+from __future__ import division
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from .. import sweep
+from ..sweep import SweepLedger, adaptive_sweep, refine_points
+
+
+class TestSweepLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'sweep.db')
+        self.ledger = SweepLedger(self.path)
+        self.ledger.add([(.01, .1), (.01, .9), (.05, .1), (.05, .9)])
+
+    def tearDown(self):
+        self.ledger.conn.close()
+        shutil.rmtree(self.dir)
+
+    def test_resume(self):
+        ledger = self.ledger
+        ledger.start(.01, .1)
+        ledger.finish(.01, .1, ['results/vf_001_01.pkl'])
+        ledger.start(.05, .9)  # left running, as if killed
+
+        # a restart sees the same state
+        ledger = SweepLedger(self.path)
+        ledger.add([(.01, .1), (.01, .9)])
+        self.assertEqual(len(ledger.jobs()), 4)
+        done = ledger.jobs('done')
+        self.assertEqual(done[0]['outputs'], '["results/vf_001_01.pkl"]')
+        self.assertEqual(sorted(ledger.schedule()),
+                         [(.01, .9), (.05, .1), (.05, .9)])
+
+        for _ in range(3):
+            ledger.start(.01, .9)
+            ledger.fail(.01, .9, 'boom')
+        self.assertNotIn((.01, .9), ledger.schedule(max_attempts=3))
+        ledger.conn.close()
+
+    def test_schedule_order(self):
+        ledger = self.ledger
+        for point in [(.01, .1), (.05, .9)]:
+            ledger.start(*point)
+            ledger.finish(*point)
+        with ledger.conn:
+            ledger.conn.execute("UPDATE jobs SET seconds = 10 * lambda_, "
+                                "state = 'pending' WHERE seconds NOT NULL")
+        # unknown points take their nearest neighbour's time
+        self.assertEqual(sorted(ledger.schedule()[:2]), [(.01, .9), (.05, .9)])
+
+    def test_refine_points(self):
+        pis, lambdas = np.linspace(0, .1, 3), np.linspace(0, 1, 3)
+        f = lambda pi, l: pi + l ** 4
+        outputs = {(p, l): f(p, l) for p in pis for l in lambdas}
+        new = refine_points(outputs, ((0, .1), (0, 1)), 4)
+        self.assertEqual(len(new), 4)
+        # the curvature is all in lambda
+        for pi, l in new:
+            self.assertIn(l, [.25, .75])
+        self.assertEqual(refine_points(outputs, ((0, .1), (0, 1)), 2,
+                                       tol=10), [])
+
+    def test_adaptive_sweep_failed_point(self):
+        f = lambda pi, l: pi + l ** 4
+        failed = []
+
+        def fake_run(ledger, n_jobs, max_attempts):
+            # the first refined point always fails
+            for pi, l in ledger.schedule(max_attempts=max_attempts):
+                ledger.start(pi, l)
+                if not failed and len(ledger.jobs()) > 9:
+                    failed.append((pi, l))
+                if (pi, l) in failed:
+                    ledger.fail(pi, l, 'boom')
+                else:
+                    ledger.finish(pi, l, rigid_out=f(pi, l))
+
+        params = {'pi_low': (0, ''), 'pi_high': (.1, ''), 'pi_n': (3, ''),
+                  'lambda_l': (0, ''), 'lambda_u': (1, ''),
+                  'lambda_n': (3, '')}
+        path = os.path.join(self.dir, 'adaptive.db')
+        run = sweep._run_scheduled
+        sweep._run_scheduled = fake_run
+        try:
+            n_done = adaptive_sweep(params, path, budget=13, batch=1)
+        finally:
+            sweep._run_scheduled = run
+        ledger = SweepLedger(path)
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(len(ledger.jobs('failed')), 1)
+        self.assertEqual(len(ledger.jobs()), 13)
+        self.assertEqual(n_done, 12)
+        ledger.conn.close()
@@ -1,5 +1,6 @@
 from __future__ import division
 
+import os
 import unittest
 
 import nose
@@ -9,10 +10,11 @@ from scipy.optimize import fminbound
 from scipy.stats import lognorm
 
 from ..gen_interp import Interp
-from ..value_function import bellman, u_
+from ..value_function import bellman, iter_bellman, u_, OptPool
 
-from ..helpers import (ss_output_flexible, ss_wage_flexible, truncated_draw)
-from ..run_value_function import run_one
+from ..helpers import (ss_output_flexible, ss_wage_flexible, truncated_draw,
+                       load_params, set_grids)
+from ..run_value_function import run_one, run_multigrid, warm_tol
 
 
 np.random.seed(42)
@@ -51,6 +53,16 @@ class testFunctions(unittest.TestCase):
                                ss_wage_flexible(params, shock=2))
 
 
+    def test_warm_tol(self):
+        params = {'warm_tol_scale': (1, 'a'), 'warm_tol_min': (.001, 'b')}
+        res_dict = {'aggL': .85}
+        self.assertEqual(warm_tol(res_dict, .8, .005, params), .005)
+        self.assertAlmostEqual(warm_tol(res_dict, .848, .005, params), .002)
+        self.assertEqual(warm_tol(res_dict, .85, .005, params), .001)
+        # without the keys it's tol
+        self.assertEqual(warm_tol(res_dict, .85, .005, {}), .005)
+
+
 class TestValueFunction(unittest.TestCase):
 
     def setUp(self):
@@ -124,6 +136,102 @@ class TestValueFunction(unittest.TestCase):
                                1.70810273, 0.91432274])
         np.testing.assert_almost_equal(expected_y, Tv.Y)
 
+    @slow
+    def test_bellman_vectorized(self):
+        params = self.params
+        params['lambda_'] = 0.8, 'a'
+        w_grid = params['w_grid'][0]
+        w0 = Interp(w_grid, -w_grid + 27.3)
+
+        Tv, ws, vals = bellman(w0, params=params)
+        vTv, vws, vvals = bellman(w0, params=params, method='vectorized')
+        np.testing.assert_almost_equal(Tv.Y, vTv.Y)
+        # optimizers agree to within xtol
+        np.testing.assert_allclose(np.asarray(vals), np.asarray(vvals),
+                                   atol=1e-5)
+
+    @slow
+    def test_bellman_native(self):
+        params = self.params
+        params['lambda_'] = 0.8, 'a'
+        w_grid = params['w_grid'][0]
+        for kind in ['linear', 'cubic', 'pchip']:
+            w0 = Interp(w_grid, -w_grid + 27.3, kind=kind)
+            Tv, ws, vals = bellman(w0, params=params)
+            nTv, nws, nvals = bellman(w0, params=params, method='native',
+                                      n_jobs=2)
+            np.testing.assert_almost_equal(Tv.Y, nTv.Y)
+            np.testing.assert_allclose(np.asarray(vals), np.asarray(nvals),
+                                       atol=1e-8)
+
+    @slow
+    def test_bellman_monotone(self):
+        params = self.params
+        params['lambda_'] = 0.8, 'a'
+        w_grid = params['w_grid'][0]
+        w0 = Interp(w_grid, -w_grid + 27.3, kind='cubic')
+        Tv, ws, vals = bellman(w0, params=params)
+        for method in ['cython', 'vectorized', 'native']:
+            mTv, mws, mvals = bellman(w0, params=params, method=method,
+                                      monotone=True)
+            np.testing.assert_allclose(vals, mvals, atol=1e-5)
+
+    @slow
+    def test_bellman_backends(self):
+        params = self.params
+        params['lambda_'] = 0.8, 'a'
+        w_grid = params['w_grid'][0]
+        w0 = Interp(w_grid, -w_grid + 27.3, kind='cubic')
+        for method in ['cython', 'native']:
+            Tv, ws, vals = bellman(w0, params=params, method=method,
+                                   backend='serial')
+            for n_jobs in [1, 3]:
+                pTv, pws, pvals = bellman(w0, params=params, method=method,
+                                          backend='processes', n_jobs=n_jobs)
+                np.testing.assert_array_equal(vals, pvals)
+        self.assertRaises(ValueError, bellman, w0, params=params,
+                          backend='threads')
+        # a pool reused across calls, as iter_bellman does
+        Tv, ws, vals = bellman(w0, params=params, method='cython',
+                               backend='serial')
+        with OptPool(vals.shape, 2) as pool:
+            for _ in range(2):
+                pTv, pws, pvals = bellman(w0, params=params,
+                                          backend='processes', pool=pool)
+                np.testing.assert_array_equal(pvals, vals)
+
+    @slow
+    def test_howard_steps(self):
+        params = self.params
+        params['lambda_'] = 0.8, 'a'
+        w_grid = params['w_grid'][0]
+        w0 = Interp(w_grid, -w_grid + 27.3)
+        Tv, ws, rest = iter_bellman(w0, tol=1e-7, strict=True, log=False,
+                                    params=params, method='native')
+        hTv, hws, hrest = iter_bellman(w0, tol=1e-7, strict=True, log=False,
+                                       params=params, method='native',
+                                       howard_steps=10)
+        np.testing.assert_allclose(Tv.Y, hTv.Y, atol=1e-5)
+        np.testing.assert_allclose(ws.Y, hws.Y, atol=1e-5)
+
+    @slow
+    def test_accelerate(self):
+        params = self.params
+        params['lambda_'] = 0.8, 'a'
+        w_grid = params['w_grid'][0]
+        w0 = Interp(w_grid, -w_grid + 27.3)
+        info = {}
+        Tv, ws, rest = iter_bellman(w0, tol=1e-7, strict=True, log=False,
+                                    params=params, method='native', info=info)
+        for kwargs in [{'accelerate': 'anderson'}, {'mqp': True}]:
+            ainfo = {}
+            aTv, aws, arest = iter_bellman(w0, tol=1e-7, strict=True,
+                                           log=False, params=params,
+                                           method='native', info=ainfo,
+                                           **kwargs)
+            np.testing.assert_allclose(Tv.Y, aTv.Y, atol=1e-5)
+            self.assertLess(ainfo['n_iter'], info['n_iter'])
+
     @slow
     def test_ss_wage_flexible(self):
         w_grid = np.linspace(0.40000000000000002, 3.5, 40)
@@ -203,6 +311,24 @@ class TestValueFunction(unittest.TestCase):
         expected = ss_output_flexible(params)
         self.assertAlmostEquals(actual, expected, 4)
 
+class TestMultigrid(unittest.TestCase):
+
+    @slow
+    def test_finishes_on_target_grid(self):
+        pth = os.path.join(os.path.dirname(__file__), '..', 'parameters.json')
+        params = load_params(pth)
+        params['pi'] = 0.02, 'a'
+        params['lambda_'] = 0.5, 'b'
+        params['multigrid'] = [[6, 4], [8, 4], [10, 4]], 'c'
+        # loose enough to stop after the second level
+        params['multigrid_tol'] = 1, 'd'
+        set_grids(params, wn=12, zn=4)
+        res_dict = run_multigrid(params)
+        self.assertEqual([level[:2] for level in res_dict['multigrid']],
+                         [(6, 4), (8, 4), (12, 4)])
+        np.testing.assert_array_equal(res_dict['Tv'].X, params['w_grid'][0])
+        self.assertEqual(len(res_dict['ws'].X), 4)
+
 if __name__ == '__main__':
     nose.runmodule(argv=[__file__, '-vvs', '-x', '--pdb', '--pdb-failure'],
                    exit=False)
@@ -7,14 +7,20 @@ v(w) = (1 - lambda_) * (u(today | w' >= 0) + beta * v(w')) +
 """
 from __future__ import division
 
+from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
+import time
+
 import numpy as np
 import pandas as pd
 from scipy.integrate import quad
 from scipy.stats import kde
 
+from fast_kde import BinnedKDE
 from gen_interp import Interp
-from helpers import maximizer, truncated_draw, ss_output_flexible
-from cfminbound import opt_loop
+from helpers import (maximizer, truncated_draw, ss_output_flexible,
+                     vec_fminbound)
+from cfminbound import opt_loop, opt_loop_c, interp_knots
 #-----------------------------------------------------------------------------
 np.random.seed(42)
 
@@ -29,7 +35,8 @@ def u_(wage, shock=1, eta=2.5, gamma=0.5, aggL=0.85049063822172699):
 
 
 def bellman(w, params, u_fn=u_, lambda_=None, z_grid=None, pi=None,
-            kind=None, w_grid=None, aggL=None):
+            kind=None, w_grid=None, aggL=None, method='cython', n_jobs=1,
+            monotone=False, backend=None, pool=None):
     """
     Differs from bellman by optimizing for *each* shock, rather than
     for the mean.  I think this is right since the agent observes Z_{it}
@@ -49,14 +56,32 @@ def bellman(w, params, u_fn=u_, lambda_=None, z_grid=None, pi=None,
     pi : steady-state (for now) inflation level.  Will be changed.
     kind : type of interpolation.  Defualt taken from w.
         Overridden if not None. str or int.  See scipy.interpolate.interp1d
+    method : str. Which optimization loop to use. One of
+        - cython :: cfminbound.opt_loop, one Brent search per cell.
+        - vectorized :: vec_opt_loop, Brent on every cell at once.
+        - native :: cfminbound.opt_loop_c, w evaluated from its knots in C.
+            w must be an Interp.
+    n_jobs : int. Number of workers for backend.
+    monotone : bool. Settle most restricted wages without a search.
+        See cfminbound.opt_loop.
+    backend : str. How the rows of the grid are split across n_jobs
+        workers.  One of
+        - serial :: a single worker.
+        - threads :: OpenMP threads.  Needs method='native'.
+        - processes :: a process pool; see parallel_opt_loop.
+        The default is threads for method='native' and serial otherwise.
+        The results don't depend on the backend or n_jobs.
+    pool : OptPool or None.  Workers for backend='processes' to reuse
+        across calls.  If None a pool is started and closed for this call.
 
     Returns
     -------
 
     Tv : The next iteration of the value function v. Instance of LinInterp.
     wage_schedule : LinInterp. Wage as function of shock.
-    vals : everything else. temporary. [(wage, shock, free_w*, res_w*)]
-        This will be grid X shocks X 5
+    vals : ndarray of everything else. [(wage, shock, value, free_w*, res_w*)]
+        This will be grid X shocks X 5.  See label_vals for a labelled
+        version.
     #-------------------------------------------------------------------------
     A note on `shock`:  Why am I taking draws from a distribution?
     I optimize at each draw, and then take the mean over those.  But
@@ -70,7 +95,6 @@ def bellman(w, params, u_fn=u_, lambda_=None, z_grid=None, pi=None,
         lambda_ = params['lambda_'][0]
     if pi is None:
         pi = params['pi'][0]
-    ln_dist = params['full_ln_dist'][0]
 
     if aggL is None:
         aggL = ss_output_flexible(params)
@@ -84,25 +108,181 @@ def bellman(w, params, u_fn=u_, lambda_=None, z_grid=None, pi=None,
     kind = kind or w.kind
     #--------------------------------------------------------------------------
     vals = np.zeros((len(w_grid), len(z_grid), 5))
-    vals = opt_loop(vals, w_grid, z_grid, w, pi, lambda_, aggL)
-
-    vals = pd.Panel(vals, items=w_grid, major_axis=z_grid,
-                    minor_axis=['wage', 'z_grid', 'value', 'm1', 'm2'])
-
-    vals.items.name = 'w_grid'
-    vals.major_axis.name = 'z_grid'
-    weights = pd.Series(ln_dist.pdf(vals.major_axis.values.astype('float64')),
-                        index=vals.major_axis)
-    weights /= weights.sum()
+    if backend is None:
+        backend = 'threads' if method == 'native' else 'serial'
+    if backend == 'serial':
+        vals = opt_kernel(method, vals, w_grid, z_grid, w, pi, lambda_, aggL,
+                          monotone=monotone)
+    elif backend == 'threads':
+        if method != 'native':
+            raise ValueError("backend='threads' needs method='native'.")
+        vals = opt_kernel(method, vals, w_grid, z_grid, w, pi, lambda_, aggL,
+                          monotone=monotone, n_jobs=n_jobs)
+    elif backend == 'processes':
+        vals = parallel_opt_loop(vals, w_grid, z_grid, w, pi, lambda_, aggL,
+                                 method=method, monotone=monotone,
+                                 n_jobs=n_jobs, pool=pool)
+    else:
+        raise ValueError("backend must be one of 'serial', 'threads', "
+                         "or 'processes'.")
 
-    weighted_values = vals.apply(lambda x: x * weights).sum(axis='major').ix['value']
-    Tv = Interp(w_grid, weighted_values.values, kind=kind)
+    weights = shock_weights(params, z_grid)
+    Tv = Interp(w_grid, vals[:, :, 2].dot(weights), kind=kind)
     # Wage(z_grid).  Doesn't matter which row for free case.
-    wage_schedule = Interp(z_grid, vals.iloc[0]['m1'].values, kind=kind)
+    wage_schedule = Interp(z_grid, vals[0, :, 3], kind=kind)
     return Tv, wage_schedule, vals
 
 
-def get_rigid_output(ws, params, flex_ws, g):
+def opt_kernel(method, vals, w_grid, z_grid, w, pi, lambda_, aggL,
+               monotone=False, n_jobs=1, row_start=0, row_stop=-1):
+    """
+    Fill rows [row_start, row_stop) of vals with the optimization loop
+    named by method.  See bellman for method and cfminbound.opt_loop for
+    the rest.
+    """
+    if method == 'cython':
+        return opt_loop(vals, w_grid, z_grid, w, pi, lambda_, aggL, monotone,
+                        row_start, row_stop)
+    elif method == 'vectorized':
+        return vec_opt_loop(vals, w_grid, z_grid, w, pi, lambda_, aggL,
+                            monotone=monotone, row_start=row_start,
+                            row_stop=row_stop)
+    elif method == 'native':
+        X, Y, D, code = interp_knots(w)
+        return opt_loop_c(vals, w_grid, z_grid, X, Y, D, code, pi, lambda_,
+                          aggL, n_jobs, monotone, row_start, row_stop)
+    else:
+        raise ValueError("method must be one of 'cython', 'vectorized', "
+                         "or 'native'.")
+
+
+# Set in each worker of an OptPool.
+_shared = {}
+
+
+def _init_worker(raw, shape):
+    _shared['vals'] = np.frombuffer(raw).reshape(shape)
+
+
+def _opt_rows(args):
+    method, row_start, row_stop, rest = args[0], args[1], args[2], args[3:]
+    w_grid, z_grid, w, pi, lambda_, aggL, monotone = rest
+    opt_kernel(method, _shared['vals'], w_grid, z_grid, w, pi, lambda_, aggL,
+               monotone=monotone, row_start=row_start, row_stop=row_stop)
+
+
+class OptPool(object):
+
+    def __init__(self, shape, n_jobs=2):
+        """
+        n_jobs worker processes for parallel_opt_loop that share one
+        buffer for a vals array of shape.  Starting processes is slow, so
+        iter_bellman keeps one pool for all its iterations.  Close it when
+        done, or use it as a context manager.
+        """
+        self.shape = tuple(shape)
+        self.n_jobs = n_jobs
+        self.raw = RawArray('d', int(np.prod(self.shape)))
+        self.vals = np.frombuffer(self.raw).reshape(self.shape)
+        self.pool = Pool(n_jobs, initializer=_init_worker,
+                         initargs=(self.raw, self.shape))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parallel_opt_loop(vals, w_grid, z_grid, w, pi, lambda_, aggL,
+                      method='cython', monotone=False, n_jobs=2, pool=None):
+    """
+    Fill vals with opt_kernel, splitting the rows over a pool of
+    n_jobs processes.
+
+    Row 0 is done first, here, since the other rows read its free wages.
+    The rest are split into contiguous blocks that the workers write
+    directly into the pool's shared copy of vals.  Each cell is computed
+    the same way whatever the split, so the result doesn't depend
+    on n_jobs.
+
+    pool is an OptPool for vals' shape to reuse.  If None, one with
+    n_jobs workers is started and closed here.
+
+    Returns
+    -------
+
+    vals : ndarray :: filled in values.
+    """
+    if pool is None:
+        with OptPool(vals.shape, n_jobs) as pool:
+            return parallel_opt_loop(vals, w_grid, z_grid, w, pi, lambda_,
+                                     aggL, method=method, monotone=monotone,
+                                     pool=pool)
+    if pool.shape != vals.shape:
+        raise ValueError("pool is for vals of shape {}. Got {} "
+                         "instead.".format(pool.shape, vals.shape))
+
+    ngrid = len(w_grid)
+    shared = pool.vals
+    shared[:] = vals
+    opt_kernel(method, shared, w_grid, z_grid, w, pi, lambda_, aggL,
+               monotone=monotone, row_start=0, row_stop=1)
+
+    blocks = np.array_split(np.arange(1, ngrid),
+                            min(ngrid - 1, 4 * pool.n_jobs))
+    tasks = [(method, int(b[0]), int(b[-1]) + 1, w_grid, z_grid, w, pi,
+              lambda_, aggL, monotone) for b in blocks if len(b)]
+    pool.pool.map(_opt_rows, tasks)
+    vals[:] = shared
+    return vals
+
+
+def shock_weights(params, z_grid=None):
+    """
+    Weights for taking expectations over z_grid.  params['z_weights'] if
+    z_grid is params' quadrature grid (see helpers.shock_quadrature),
+    otherwise the lognormal pdf at each point, normalized to sum to one.
+    """
+    if z_grid is None:
+        z_grid = params['z_grid'][0]
+    if 'z_weights' in params and np.array_equal(z_grid,
+                                                params['z_grid'][0]):
+        return params['z_weights'][0]
+    ln_dist = params['full_ln_dist'][0]
+    weights = ln_dist.pdf(np.asarray(z_grid, dtype='float64'))
+    return weights / weights.sum()
+
+
+def label_vals(vals):
+    """
+    Labelled version of the vals array returned by bellman.
+
+    Parameters
+    ----------
+
+    vals : ndarray :: (len(w_grid) x len(z_grid) x 5)
+
+    Returns
+    -------
+
+    DataFrame indexed by (w_grid, z_grid) with columns
+        ['wage', 'z_grid', 'value', 'm1', 'm2'].
+    """
+    ngrid, nshock, _ = vals.shape
+    idx = pd.MultiIndex.from_arrays([vals[:, :, 0].ravel(),
+                                     vals[:, :, 1].ravel()],
+                                    names=['w_grid', 'z_grid'])
+    return pd.DataFrame(vals.reshape(ngrid * nshock, 5), index=idx,
+                        columns=['wage', 'z_grid', 'value', 'm1', 'm2'])
+
+
+def get_rigid_output(ws, params, flex_ws, g, p3_method='grid',
+                     p3_nodes=20001, kde_method='binned', sampler='inverse'):
     """
 
     Eq 18 in DH.
@@ -116,6 +296,21 @@ def get_rigid_output(ws, params, flex_ws, g):
     g: CDF of wages.  Probably instance of ecdf.
     shocks : shocks that generated g.
 
+    The expectations over shocks use params' quadrature nodes and
+    weights when it has z_weights (see helpers.shock_quadrature), and
+    1000 draws from truncated_draw otherwise.
+    p3_method : str.  How the integrals in p3 are computed.  One of
+        - grid :: all at once from a cumulative integral on a fixed grid.
+            See p3_grid.
+        - quad :: one call to quad per shock.
+    p3_nodes : int.  Number of grid points for p3_method='grid'.
+    kde_method : str.  Density estimate of g.  One of
+        - binned :: fast_kde.BinnedKDE.
+        - exact :: scipy's gaussian_kde.
+    sampler : str.  How the shocks are drawn; the method argument of
+        truncated_draw.  'halton' or 'sobol' lower the variance of
+        output at the same number of draws.
+
     Returns
     -------
 
@@ -128,36 +323,60 @@ def get_rigid_output(ws, params, flex_ws, g):
     # z_grid = params['z_grid'][0]
     # ln_dist = params['full_ln_dist'][0]
     # shocks = np.sort(shocks)
-    dg = kde.gaussian_kde(g.observations.ravel())
-    shocks = np.sort(truncated_draw(params, lower=.005, upper=.995,
-                                    kind='lognorm', size=1000), axis=0).ravel()
+    if kde_method == 'binned':
+        dg = BinnedKDE(g.observations.ravel())
+    elif kde_method == 'exact':
+        dg = kde.gaussian_kde(g.observations.ravel())
+    else:
+        raise ValueError("kde_method must be one of 'binned' or 'exact'.")
+    if 'z_weights' in params:
+        # quadrature; see helpers.shock_quadrature
+        shocks, weights = params['z_grid'][0], params['z_weights'][0]
+        expect = lambda x: np.dot(x, weights)
+    else:
+        shocks = np.sort(truncated_draw(params, lower=.005, upper=.995,
+                                        kind='lognorm', size=1000,
+                                        method=sampler), axis=0).ravel()
+        expect = lambda x: x.mean()
 
     w_grid = params['w_grid'][0]
     wmax = w_grid[-1]
 
-    p1 = ((1 / shocks) ** (gamma * (eta - 1) / (gamma + eta)) *
-          (flex_ws(shocks) / ws(shocks)) ** (eta - 1)).mean()
+    p1 = expect((1 / shocks) ** (gamma * (eta - 1) / (gamma + eta)) *
+                (flex_ws(shocks) / ws(shocks)) ** (eta - 1))
 
-    p2 = ((1 / shocks) ** (gamma * (eta - 1) / (gamma + eta)) *
-          g(ws(shocks).ravel() * (1 + pi)) *
-          (flex_ws(shocks) / ws(shocks)) ** (eta - 1)).mean()
+    p2 = expect((1 / shocks) ** (gamma * (eta - 1) / (gamma + eta)) *
+                g(ws(shocks).ravel() * (1 + pi)) *
+                (flex_ws(shocks) / ws(shocks)) ** (eta - 1))
 
-    inner_f = lambda w, z: ((1 + pi) * dg.evaluate(w * (1 + pi))[0] *
-                            (flex_ws(z) / w)**(eta - 1))
-
-    w_range = np.sort(ws(shocks))
-    sub_w = lambda z: w_range[w_range > ws(z)]  # TODO: check on > vs >=
-    p3 = np.zeros(len(shocks))
-
-    start_check = len(shocks) / 2
-    for i, z in enumerate(shocks[:-1]):  # empty range for last one
-        inner_range = sub_w(z)
-        a = inner_range[0]
-        inner_vals = quad(inner_f, a, wmax, args=z)[0]
-        p3[i] = (1 / z)**(gamma * (eta - 1) / (eta + gamma)) * inner_vals
-        if i > start_check and (p3[i-30:i] < 1e-6).all():
-            break
-    p3 = p3.mean()
+    if 'z_weights' in params:
+        # integrate from ws(z) itself rather than the next draw above it.
+        w_range = None
+    else:
+        w_range = np.sort(ws(shocks))
+    if p3_method == 'grid':
+        p3 = expect(p3_grid(shocks, ws, flex_ws, dg.evaluate, w_range, wmax,
+                            pi, eta, gamma, n=p3_nodes))
+    elif p3_method == 'quad':
+        if w_range is None:
+            raise ValueError("p3_method='quad' needs Monte Carlo shocks.")
+        inner_f = lambda w, z: ((1 + pi) * dg.evaluate(w * (1 + pi))[0] *
+                                (flex_ws(z) / w)**(eta - 1))
+
+        sub_w = lambda z: w_range[w_range > ws(z)]  # TODO: check on > vs >=
+        p3 = np.zeros(len(shocks))
+
+        start_check = len(shocks) / 2
+        for i, z in enumerate(shocks[:-1]):  # empty range for last one
+            inner_range = sub_w(z)
+            a = inner_range[0]
+            inner_vals = quad(inner_f, a, wmax, args=z)[0]
+            p3[i] = (1 / z)**(gamma * (eta - 1) / (eta + gamma)) * inner_vals
+            if i > start_check and (p3[i-30:i] < 1e-6).all():
+                break
+        p3 = p3.mean()
+    else:
+        raise ValueError("p3_method must be one of 'grid' or 'quad'.")
 
     # z_part is \tilde{Z} in my notes.
     # z_part is decreasing in p1 + p2
@@ -176,20 +395,147 @@ def get_rigid_output(ws, params, flex_ws, g):
     return output(z_part(p1, p2, p3))
 
 
-def iter_bellman(v, tol=1e-3, maxiter=1000, strict=True, log=True, **kwargs):
+def p3_grid(shocks, ws, flex_ws, density, w_range, wmax, pi, eta, gamma,
+            n=20001):
+    """
+    The p3 terms of get_rigid_output for every shock at once.
+
+    For shock z the term is
+
+        (1/z)^c * flex_ws(z)^(eta-1) * F(a(z), wmax)
+
+    with c = gamma (eta - 1) / (eta + gamma), a(z) the first element of
+    w_range above ws(z) (or ws(z) itself if w_range is None), and
+
+        F(a, b) = int_a^b (1 + pi) density(w (1 + pi)) w^(1-eta) dw.
+
+    The integrand doesn't depend on z, so density is evaluated once on n
+    evenly spaced points from the smallest a(z) to wmax.  Every F(a, wmax)
+    then comes from a single cumulative trapezoid sum, interpolated
+    linearly at a(z).  The error in each F is at most
+
+        (wmax - a) h^2 max|f''| / 12 + h^2 max|f'| / 8
+
+    for f the integrand and h the grid spacing.  With the default n,
+    output from get_rigid_output is within about 1e-7 of the quad loop
+    (8e-6 at n=2001); the error falls with h^2.  The terms are 0 when no element of
+    w_range is above ws(z), including the largest shock.
+
+    The old loop over quad (p3_method='quad') also stopped once 30 terms
+    in a row were below 1e-6 past the median shock, treating the rest as
+    0.  These are now computed, which raises p3 by less than 1e-6.
+
+    Parameters
+    ----------
+
+    shocks : ndarray.  Sorted.
+    ws, flex_ws : callable rigid and flexible wage schedules.
+    density : callable.  The density of wages, e.g. gaussian_kde.evaluate.
+    w_range : ndarray or None.  Sorted wages.
+    wmax : float.  Top of the wage grid.
+    pi, eta, gamma : float.  Parameters.
+    n : int.  Number of grid points.
+
+    Returns
+    -------
+
+    p3 : ndarray.  One term per shock.
+    """
+    if w_range is None:
+        a = ws(shocks).ravel()
+        has_range = a < wmax
+        a = a[has_range]
+    else:
+        idx = np.searchsorted(w_range, ws(shocks).ravel(), side='right')
+        has_range = idx < len(w_range)
+        has_range[-1] = False
+        a = w_range[idx[has_range]]
+    p3 = np.zeros(len(shocks))
+    if not has_range.any():
+        return p3
+
+    x = np.linspace(a.min(), wmax, n)
+    f = (1 + pi) * density(x * (1 + pi)) * x ** (1 - eta)
+    cum = np.concatenate([[0], np.cumsum(np.diff(x) * (f[1:] + f[:-1]) / 2)])
+    inner = cum[-1] - np.interp(a, x, cum)
+
+    z = shocks[has_range]
+    p3[has_range] = ((1 / z)**(gamma * (eta - 1) / (eta + gamma)) *
+                     flex_ws(z)**(eta - 1) * inner)
+    return p3
+
+
+def iter_bellman(v, tol=1e-3, maxiter=1000, strict=True, log=True,
+                 howard_steps=0, accelerate=None, anderson_m=5, mqp=False,
+                 info=None, **kwargs):
     """
+    Iterate on the bellman operator until the sup norm distance
+    between v and Tv is less than tol.
+
+    howard_steps : int. Number of policy evaluation steps (see
+        evaluate_policy) between optimizations.  0 is plain value function
+        iteration.  The error is always that of a full optimization, so
+        tol means the same thing either way.
+    accelerate : None or 'anderson'.  With 'anderson' the next guess mixes
+        the last anderson_m iterates (see anderson_mix).
+    anderson_m : int. Length of the Anderson history.
+    mqp : bool. Also stop once the MacQueen-Porteus bounds on the fixed
+        point are within tol of each other, returning their midpoint.
+    info : dict or None.  If given, filled with the number of
+        optimizations 'n_iter', the final 'error', wall 'time' in
+        seconds, and optimizations saved by policy evaluation,
+        'howard_saved'.
+
+    Other kwargs are passed on to bellman.  With backend='processes'
+    and no pool, one OptPool serves every iteration.
     """
+    if (kwargs.get('backend') != 'processes' or
+            kwargs.get('pool') is not None):
+        return _iter_bellman(v, tol, maxiter, strict, log, howard_steps,
+                             accelerate, anderson_m, mqp, info, **kwargs)
+    params = kwargs['params']
+    w_grid = kwargs.get('w_grid')
+    z_grid = kwargs.get('z_grid')
+    if w_grid is None:
+        w_grid = params['w_grid'][0]
+    if z_grid is None:
+        z_grid = params['z_grid'][0]
+    with OptPool((len(w_grid), len(z_grid), 5),
+                 kwargs.get('n_jobs', 1)) as pool:
+        return _iter_bellman(v, tol, maxiter, strict, log, howard_steps,
+                             accelerate, anderson_m, mqp, info, pool=pool,
+                             **kwargs)
+
+
+def _iter_bellman(v, tol, maxiter, strict, log, howard_steps, accelerate,
+                  anderson_m, mqp, info, **kwargs):
     params = kwargs.pop('params')
     pi = params['pi'][0]
     lambda_ = params['lambda_'][0]
+    beta = params['beta'][0]
     e = 1
+    saved = 0
+    start = time.time()
+    xs, gs = [], []  # Anderson history of iterates and their images.
     vfs, wss, rests, es = [], [], [], []
     for i in range(maxiter):
         Tv, ws, rest = bellman(v, params, **kwargs)
         e = np.max(np.abs(Tv.Y - v.Y))
         print("At iteration {} the error is {} for pi={}, lambda={}.".format(i,
               e, pi, lambda_))
+        if mqp and e >= tol:
+            # v* is within [Tv + lo, Tv + hi]; see MacQueen (1966).
+            lo, hi = mqp_bounds(v, Tv, beta)
+            if hi - lo < tol:
+                print("MacQueen-Porteus bounds within {}.".format(hi - lo))
+                Tv = Interp(Tv.X, Tv.Y + (lo + hi) / 2, kind=Tv.kind)
+                e = 0
         if e < tol:
+            if howard_steps:
+                print("Policy evaluation saved {} optimizations.".format(saved))
+            if info is not None:
+                info.update(n_iter=i + 1, error=e, time=time.time() - start,
+                            howard_saved=saved)
             if log:
                 return Tv, ws, rest, vfs, wss, rests, ws
             else:
@@ -200,16 +546,119 @@ def iter_bellman(v, tol=1e-3, maxiter=1000, strict=True, log=True, **kwargs):
             rests.append(rest)
             es.append(es)
 
-        v = Tv
+        if accelerate is None:
+            v = Tv
+        elif accelerate == 'anderson':
+            xs, gs = xs[-anderson_m:] + [v.Y], gs[-anderson_m:] + [Tv.Y]
+            v = Interp(Tv.X, anderson_mix(xs, gs), kind=Tv.kind)
+        else:
+            raise ValueError("accelerate must be one of None or 'anderson'.")
+        if howard_steps:
+            v = evaluate_policy(v, rest, params, steps=howard_steps,
+                                lambda_=kwargs.get('lambda_'),
+                                pi=kwargs.get('pi'), aggL=kwargs.get('aggL'))
+            saved += howard_steps
     else:
         print("Returning before convergence! specified tolerance was {},"
               " but current error is {}".format(tol, e))
+        if info is not None:
+            info.update(n_iter=maxiter, error=e, time=time.time() - start,
+                        howard_saved=saved)
         if strict:
             raise ValueError
         else:
             return Tv, ws, rest
 
 
+def mqp_bounds(v, Tv, beta):
+    """
+    MacQueen-Porteus error bounds.
+
+    For a monotone contraction with modulus beta that shifts by beta * c
+    when c is added to its argument, the fixed point lies between
+    Tv + lo and Tv + hi.
+
+    Returns
+    -------
+
+    lo, hi : floats
+    """
+    d = Tv.Y - v.Y
+    c = beta / (1 - beta)
+    return c * np.min(d), c * np.max(d)
+
+
+def anderson_mix(xs, gs):
+    """
+    Anderson mixing for the fixed point x = T(x).
+
+    Parameters
+    ----------
+
+    xs : list of past iterates (arrays), oldest first.
+    gs : list of T applied to each element of xs.
+
+    Returns
+    -------
+
+    array. The next iterate.  Falls back to gs[-1] (plain iteration)
+        if there isn't enough history or the mixed guess isn't finite.
+    """
+    if len(xs) < 2:
+        return gs[-1]
+    G = np.array(gs).T
+    F = G - np.array(xs).T
+    dF, dG = np.diff(F, axis=1), np.diff(G, axis=1)
+    gamma = np.linalg.lstsq(dF, F[:, -1], rcond=-1)[0]
+    mixed = G[:, -1] - dG.dot(gamma)
+    if not np.isfinite(mixed).all():
+        return gs[-1]
+    return mixed
+
+
+def evaluate_policy(v, vals, params, steps=1, lambda_=None, pi=None,
+                    aggL=None):
+    """
+    Apply the bellman operator steps times, holding the wages chosen in
+    vals fixed rather than optimizing again (Howard's improvement).
+
+    Parameters
+    ----------
+
+    v : Interp. Value function to start from.
+    vals : ndarray. Output of bellman; supplies the grids and the
+        free (m1) and restricted (m2) wages.
+    params : dict of parameters.
+    steps : int. Number of times to apply the operator.
+
+    Returns
+    -------
+
+    v : Interp on the same grid and of the same kind.
+    """
+    if lambda_ is None:
+        lambda_ = params['lambda_'][0]
+    if pi is None:
+        pi = params['pi'][0]
+    if aggL is None:
+        aggL = ss_output_flexible(params)
+    beta = params['beta'][0]
+
+    w_grid = vals[:, 0, 0]
+    z_grid = vals[0, :, 1]
+    m1, m2 = vals[0, :, 3], vals[:, :, 4]
+    weights = shock_weights(params, z_grid)
+
+    # Period utility doesn't change with v.
+    flow = ((1 - lambda_) * u_(m1, shock=z_grid, aggL=aggL).dot(weights) +
+            lambda_ * u_(m2, shock=z_grid, aggL=aggL).dot(weights))
+    for i in range(steps):
+        cont = ((1 - lambda_) * v(m1 / (1 + pi)).dot(weights) +
+                lambda_ * v(m2 / (1 + pi)).dot(weights))
+        v = Interp(w_grid, flow + beta * cont, kind=v.kind)
+    return v
+
+
 def taylor_rule(y, pi, ybar, pibar, gy, gpi, beta):
     """
     Equation 14 in DH.
@@ -260,3 +709,79 @@ def py_opt_loop(w_grid, z_grid, w, vals, params, aggL=None):
             value = -1 * ((1 - lambda_) * h_(m1, z) + lambda_ * h_(m2, z))
             vals[i, j] = (y, z, value, m1, m2)
     return vals
+
+
+def vec_opt_loop(vals, w_grid, z_grid, w, pi, lambda_, aggL, beta=.97,
+                 eta=2.5, gamma=0.5, monotone=False, xtol=1e-5, row_start=0,
+                 row_stop=-1):
+    """
+    Vectorized dropin for cfminbound.opt_loop.
+
+    Rather than one Brent search per (wage, shock) cell, every search is
+    run at once by `vec_fminbound`.  Each iteration evaluates w on all the
+    unconverged trial points in a single call.  The defaults for beta, eta
+    and gamma match those hardcoded in cfminbound.ch_.
+
+    Parameters
+    ----------
+    vals : ndarray :: (len(w_grid) x len(z_grid) x 5).  Will be filled.
+    w_grid : ndarray :: discrete set of wages
+    z_grid : ndarray :: discrete set of shocks.
+    w : callable value function.  Must accept arrays.
+    monotone : bool :: See cfminbound.opt_loop.  The free wages are found
+        first, and only the restricted problems they don't settle
+        are searched.
+    row_start, row_stop : int :: See cfminbound.opt_loop.
+
+    Returns
+    -------
+
+    vals : ndarray :: filled in values.
+    """
+    w_max = w_grid[-1]
+    if row_stop < 0:
+        row_stop = len(w_grid)
+    nrow, nshock = row_stop - row_start, len(z_grid)
+    # Row 0 searches for the free wages; the others read them from vals.
+    free = row_start == 0
+
+    # See equatioon 13 in DH
+    h_ = lambda x, ashock: -1 * (u_(x, shock=ashock, eta=eta, gamma=gamma,
+                                    aggL=aggL) + beta * w((x / (1 + pi))))
+
+    y = np.tile(w_grid[row_start:row_stop, np.newaxis], (1, nshock))
+    z = np.tile(z_grid, (nrow, 1))
+    if monotone:
+        if free:
+            m1 = vec_fminbound(h_, 0, w_max, args=(z_grid,), xtol=xtol)
+        else:
+            m1 = vals[0, :, 3]
+        m1 = np.tile(m1, (nrow, 1))
+        m2 = np.where(y <= m1, m1, y)
+        with np.errstate(invalid='ignore'):
+            search = (y > m1) & ~(h_(y, z) <= h_(y + xtol, z))
+        m2[search] = vec_fminbound(h_, y[search], w_max, args=(z[search],),
+                                   xtol=xtol)
+    elif free:
+        # The free searches (one per shock) and the restricted searches
+        # (one per cell) all go in the same batch.
+        lower = np.concatenate([np.zeros(nshock), y.ravel()])
+        shocks = np.concatenate([z_grid, z.ravel()])
+        xf = vec_fminbound(h_, lower, w_max, args=(shocks,), xtol=xtol)
+        m1 = np.tile(xf[:nshock], (nrow, 1))
+        m2 = xf[nshock:].reshape(nrow, nshock)
+    else:
+        m1 = np.tile(vals[0, :, 3], (nrow, 1))
+        m2 = vec_fminbound(h_, y, w_max, args=(z,), xtol=xtol)
+
+    value = -1 * ((1 - lambda_) * h_(m1, z) + lambda_ * h_(m2, z))
+    if np.isnan(value).any():
+        raise ValueError
+
+    rows = slice(row_start, row_stop)
+    vals[rows, :, 0] = y
+    vals[rows, :, 1] = z
+    vals[rows, :, 2] = value
+    vals[rows, :, 3] = m1
+    vals[rows, :, 4] = m2
+    return vals
@@ -30,6 +30,8 @@ setup(name='dnwr_zlb',
                 'writing',
                 'vb_suite'],
       cmdclass={'build_ext': build_ext},
-      ext_modules=[Extension("model/cfminbound", ["model/cfminbound.pyx"])],
+      ext_modules=[Extension("model/cfminbound", ["model/cfminbound.pyx"],
+                             extra_compile_args=['-fopenmp'],
+                             extra_link_args=['-fopenmp'])],
       include_dirs=[np.get_include()]
       )